@@ -0,0 +1,135 @@
+import os
+import sys
+import pickle
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from models import fit_ltr_model, read_ltr_dataset
+from prepare_folds import get_folds_query_ids
+from prepare_ml_ranking import prepare_ml_ranked, get_topics_docid_score
+
+
+#learners trained in process (fit_ltr_model), the other learners being run by the shell script
+CV_LEARNERS = ['lambdamart']
+#datasets of the cross-validation, shared with the (forked) fold workers
+_cv_datasets = None
+
+
+def get_letor_dataset(path):
+        '''
+            load a LETOR file (or fold view) into arrays: features, relevance, query ids and document ids
+        '''
+        X, y, qids, comments = read_ltr_dataset(path)
+        docids = np.array([comment.strip() for comment in comments])
+        return X, y, qids, docids
+
+
+def get_validation_split(qids, fraction, seed):
+        '''
+            split the rows of a training set into training and validation rows on the queries
+        '''
+        query_ids = np.unique(qids)
+        rng = np.random.RandomState(seed)
+        num_validation = int(round(fraction * len(query_ids)))
+        validation_query_ids = rng.permutation(query_ids)[:num_validation]
+        validation_mask = np.isin(qids, validation_query_ids)
+        return ~validation_mask, validation_mask
+
+
+def train_and_score_fold(fold, validation_fraction=0.3, seed=0, model_path=None):
+        '''
+            train a model on the training queries of all the other folds and score the
+            test queries of the fold in memory: {topic_id: (docids, scores)}
+        '''
+        folds_query_ids, (TX, Ty, Tqids, _), (EX, _, Eqids, Edocids) = _cv_datasets
+
+        train_query_ids = [qid for other in range(len(folds_query_ids)) if other != fold - 1
+                           for qid in folds_query_ids[other]]
+        train_rows = np.flatnonzero(np.isin(Tqids, train_query_ids))
+        train_mask, validation_mask = get_validation_split(Tqids[train_rows], validation_fraction, seed + fold)
+        fit_rows = train_rows[train_mask]
+        validation_rows = train_rows[validation_mask]
+
+        model = fit_ltr_model(TX[fit_rows], Ty[fit_rows], Tqids[fit_rows],
+                              TX[validation_rows], Ty[validation_rows], Tqids[validation_rows])
+        if model_path is not None:
+            with open(model_path, 'wb') as fw:
+                pickle.dump(model, fw)
+
+        test_rows = np.flatnonzero(np.isin(Eqids, folds_query_ids[fold - 1]))
+        scores = model.predict(EX[test_rows])
+
+        return get_topics_docid_score(Eqids[test_rows], Edocids[test_rows], np.asarray(scores, dtype=np.float64))
+
+
+def _train_and_score_fold_worker(args):
+        return train_and_score_fold(*args)
+
+
+def cross_validation(cmt_path, dist, rrank, learner, nfolds, input_folder, output_folder, run_folder,
+                     workers=None, validation_fraction=0.3, seed=0, save_models=False):
+        '''
+            Cross-validating a learning to rank model in process: the training and testing
+            datasets are loaded once, the folds are trained in parallel (forked) workers and
+            the test folds scored in memory, straight into the reranked TREC run
+        '''
+        global _cv_datasets
+
+        if learner not in CV_LEARNERS:
+            raise ValueError('learner not trained in process: ' + str(learner))
+        train_path = os.path.join(output_folder, cmt_path+'_query.ltr.train.'+dist+'.'+str(rrank))
+        test_path = os.path.join(output_folder, cmt_path+'_query.ltr.test.'+dist+'.'+str(rrank))
+
+        folds_query_ids = get_folds_query_ids(input_folder, nfolds)
+        _cv_datasets = (folds_query_ids, get_letor_dataset(train_path), get_letor_dataset(test_path))
+
+        tasks = []
+        for fold in range(1, nfolds + 1):
+            model_path = None
+            if save_models:
+                model_path = os.path.join(output_folder, 'train/'+cmt_path+'_query.ltr.train.'+dist+'.'+str(rrank)+'.f'+str(fold)+'tr.'+learner)
+            tasks.append((fold, validation_fraction, seed, model_path))
+
+        if workers is None:
+            workers = min(nfolds, multiprocessing.cpu_count())
+        if workers > 1:
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                folds_topics_docid_score = pool.map(_train_and_score_fold_worker, tasks)
+        else:
+            folds_topics_docid_score = [_train_and_score_fold_worker(task) for task in tasks]
+
+        _cv_datasets = None
+        prepare_ml_ranked(cmt_path, dist, rrank, learner, nfolds, input_folder, output_folder, run_folder,
+                          folds_topics_docid_score)
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description='In-process cross-validation of a learning to rank model')
+        parser.add_argument('coll')
+        parser.add_argument('model')
+        parser.add_argument('topics')
+        parser.add_argument('dist')
+        parser.add_argument('rrank')
+        parser.add_argument('--learner', choices=CV_LEARNERS, default='lambdamart')
+        parser.add_argument('--nfolds', type=int, default=5)
+        parser.add_argument('--input-folder', default='input/data')
+        parser.add_argument('--output-folder', default='output/l2r-dataset')
+        parser.add_argument('--run-folder', default='output/runs')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='number of folds trained in parallel (default: one per fold, up to the number of cpus)')
+        parser.add_argument('--validation-fraction', type=float, default=0.3,
+                            help='fraction of the training queries held out for early stopping')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save-models', action='store_true',
+                            help='pickle the model of every fold next to the fold training files')
+        args = parser.parse_args(argv)
+
+        cmt_path = args.coll + '_' + args.model + '_' + args.topics
+        cross_validation(cmt_path, args.dist, args.rrank, args.learner, args.nfolds, args.input_folder,
+                         args.output_folder, args.run_folder, args.workers, args.validation_fraction, args.seed,
+                         args.save_models)
+
+if __name__ == '__main__':
+        main()
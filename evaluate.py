@@ -0,0 +1,181 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from loader.qrels import get_qrels_index
+from loader.run_result import get_run_results
+from loader.vocabulary import get_collection_vocabulary
+
+
+def get_qrels_arrays(qrels_index):
+        '''
+            judged documents of every query of a QrelsIndex as sorted interned docid and
+            relevance grade arrays, the negative grades (e.g. spam) counting as non-relevant
+        '''
+        qrels_arrays = {}
+        for query_id in qrels_index.vocabulary.queries.get_terms(qrels_index.query_ids).tolist():
+            docids, grades = qrels_index.get_query_judgements(query_id)
+            qrels_arrays[query_id] = (docids, np.maximum(grades, 0).astype(np.int64))
+        return qrels_arrays
+
+
+def get_ranked_grades(qrels_arrays, run_result, query_ids, depth=None):
+        '''
+            relevance grades of the ranked documents of the queries, padded with zeros
+            into a (queries, documents) matrix; as trec_eval does, the documents are ranked
+            by decreasing score and then by decreasing docid, whatever their run rank.
+            The run and the qrels are interned in the same collection vocabulary
+        '''
+        empty_docids = np.array([], dtype=np.int32)
+        empty_grades = np.array([], dtype=np.int64)
+
+        queries_grades = []
+        for query_id in query_ids:
+            query_run = run_result.get_query_run(query_id)
+            if query_run is None:
+                ranked_docids = empty_docids
+            else:
+                _, docids, _, scores = query_run
+                docid_terms = run_result.vocabulary.documents.get_terms(docids)
+                ranked_docids = docids[np.lexsort((docid_terms, scores))[::-1][:depth]]
+
+            judged_docids, rels = qrels_arrays.get(query_id, (empty_docids, empty_grades))
+            if len(judged_docids) == 0:
+                queries_grades.append(np.zeros(len(ranked_docids), dtype=np.int64))
+                continue
+            positions = np.minimum(np.searchsorted(judged_docids, ranked_docids), len(judged_docids) - 1)
+            queries_grades.append(np.where(judged_docids[positions] == ranked_docids, rels[positions], 0))
+
+        grades = np.zeros((len(query_ids), max([len(query_grades) for query_grades in queries_grades] + [0])), dtype=np.int64)
+        for idx, query_grades in enumerate(queries_grades):
+            grades[idx, :len(query_grades)] = query_grades
+        return grades
+
+
+def get_ideal_grades(qrels_arrays, query_ids, k):
+        '''
+            the k highest relevance grades of the queries, padded with zeros
+        '''
+        ideal = np.zeros((len(query_ids), k), dtype=np.int64)
+        for idx, query_id in enumerate(query_ids):
+            if query_id in qrels_arrays:
+                query_grades = np.sort(qrels_arrays[query_id][1])[::-1][:k]
+                ideal[idx, :len(query_grades)] = query_grades
+        return ideal
+
+
+def get_dcg(grades, k):
+        discount = 1.0 / np.log2(np.arange(2, k + 2))
+        grades = grades[:, :k]
+        return np.dot(grades, discount[:grades.shape[1]])
+
+
+def get_err(grades, k, max_grade):
+        '''
+            expected reciprocal rank at k (Chapelle et al., 2009) of ranked relevance grades
+        '''
+        grades = grades[:, :k]
+        if max_grade <= 0 or grades.shape[1] == 0:
+            return np.zeros(grades.shape[0])
+        stop = (np.power(2.0, grades) - 1.0) / np.power(2.0, max_grade)
+        #probability of the user reaching each rank
+        reach = np.cumprod(np.hstack([np.ones((grades.shape[0], 1)), 1.0 - stop[:, :-1]]), axis=1)
+        return np.dot(stop * reach, 1.0 / np.arange(1, grades.shape[1] + 1))
+
+
+def get_evaluation_measures(ndcg_k=20, err_k=20):
+        return ['map', 'P_10', 'ndcg_cut_' + str(ndcg_k), 'err_' + str(err_k)]
+
+
+def evaluate_run(qrels_arrays, run_result, ndcg_k=20, err_k=20, depth=None, complete=False):
+        '''
+            per query MAP, P@10, nDCG@ndcg_k and ERR@err_k of a run (RunResult),
+            computed over the padded relevance grades of all the queries at once. The queries are
+            those of the run that are judged, or all the judged queries when complete (as trec_eval -c).
+            Returns the query ids and {measure: per query values}
+        '''
+        if complete:
+            query_ids = list(qrels_arrays.keys())
+        else:
+            query_ids = [query_id for query_id in qrels_arrays if query_id in run_result]
+
+        grades = get_ranked_grades(qrels_arrays, run_result, query_ids, depth)
+        relevant = grades > 0
+        num_rel = np.array([np.count_nonzero(qrels_arrays[query_id][1]) for query_id in query_ids], dtype=np.float64)
+        ranks = np.arange(1, grades.shape[1] + 1)
+        hits = np.cumsum(relevant, axis=1)
+
+        average_precision = np.zeros(len(query_ids))
+        np.divide((relevant * hits / ranks).sum(axis=1), num_rel, out=average_precision, where=num_rel > 0)
+        precision_10 = hits[:, :10].max(axis=1, initial=0) / 10.0
+
+        idcg = get_dcg(get_ideal_grades(qrels_arrays, query_ids, ndcg_k), ndcg_k)
+        ndcg = np.zeros(len(query_ids))
+        np.divide(get_dcg(grades, ndcg_k), idcg, out=ndcg, where=idcg > 0)
+
+        max_grade = max([int(rels.max()) for _, rels in qrels_arrays.values() if len(rels) > 0] + [0])
+        err = get_err(grades, err_k, max_grade)
+
+        measures = get_evaluation_measures(ndcg_k, err_k)
+        return query_ids, dict(zip(measures, [average_precision, precision_10, ndcg, err]))
+
+
+def evaluate_runs(qrels_path, run_paths, ndcg_k=20, err_k=20, depth=None, complete=False, vocabulary=None):
+        '''
+            evaluate several run files against a qrels file loaded once, the qrels and the
+            runs being interned in the same collection vocabulary:
+            [(run_path, query_ids, {measure: per query values}), ...]
+        '''
+        if vocabulary is None:
+            vocabulary = get_collection_vocabulary()
+        qrels_arrays = get_qrels_arrays(get_qrels_index(qrels_path, vocabulary))
+
+        evaluations = []
+        for run_path in run_paths:
+            run_result = get_run_results([run_path], vocabulary, score_dtype=np.float64)[0]
+            query_ids, measures = evaluate_run(qrels_arrays, run_result, ndcg_k, err_k, depth, complete)
+            evaluations.append((run_path, query_ids, measures))
+        return evaluations
+
+
+def write_evaluations(fw, evaluations, ndcg_k=20, err_k=20, per_query=False):
+        '''
+            "run<TAB>measure<TAB>query_id<TAB>value" lines, the mean over the queries being
+            reported as the 'all' query
+        '''
+        for run_path, query_ids, measures in evaluations:
+            run_name = os.path.basename(run_path)
+            for measure in get_evaluation_measures(ndcg_k, err_k):
+                values = measures[measure]
+                if per_query:
+                    for query_id, value in zip(query_ids, values.tolist()):
+                        fw.write('%s\t%s\t%s\t%.4f\n' % (run_name, measure, query_id, value))
+                mean = values.mean() if len(values) > 0 else 0.0
+                fw.write('%s\t%s\t%s\t%.4f\n' % (run_name, measure, 'all', mean))
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description='Evaluate TREC runs (MAP, P@10, nDCG@k, ERR@k) against a qrels file')
+        parser.add_argument('qrels_path')
+        parser.add_argument('run_paths', nargs='+')
+        parser.add_argument('--ndcg-k', type=int, default=20)
+        parser.add_argument('--err-k', type=int, default=20)
+        parser.add_argument('--depth', type=int, default=None,
+                            help='number of documents per query evaluated (default: all the ranked documents)')
+        parser.add_argument('--complete', action='store_true',
+                            help='average over all the judged queries, the queries missing from a run scoring 0')
+        parser.add_argument('--per-query', action='store_true')
+        parser.add_argument('--vocabulary', default=None,
+                            help='path of the persisted collection vocabulary (<path>.qids and <path>.docids)')
+        args = parser.parse_args(argv)
+
+        vocabulary = get_collection_vocabulary(args.vocabulary)
+        evaluations = evaluate_runs(args.qrels_path, args.run_paths, args.ndcg_k, args.err_k, args.depth, args.complete,
+                                    vocabulary)
+        vocabulary.save()
+        write_evaluations(sys.stdout, evaluations, args.ndcg_k, args.err_k, args.per_query)
+
+if __name__ == '__main__':
+        main()
@@ -0,0 +1,174 @@
+import os
+import sys
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from loader.topics import get_topics
+from loader.run_result import get_run_result_arrays
+from tools.indri import get_indri_index, IndexStatistics, get_term_frequency_matrix
+
+#features written for every query-document pair, BM25 being the second one as
+#get_query_doc_features expects it
+FEATURE_NAMES = ['tf_idf', 'bm25', 'lm_dirichlet', 'doc_length']
+DOCUMENT_BATCH_SIZE = 256
+
+
+def get_retrieval_features(statistics, query_terms, tf, lengths, k1=1.2, b=0.75, mu=2500.0):
+        '''
+            (documents, features) matrix of the FEATURE_NAMES of a batch of documents, from
+            their (documents, query terms) frequency matrix and their lengths
+        '''
+        term_ids, qtf, df, cf = query_terms
+        num_documents = float(statistics.num_documents)
+        lengths = lengths.astype(np.float64)
+        features = np.zeros((len(lengths), len(FEATURE_NAMES)))
+        features[:, 3] = lengths
+        if len(term_ids) == 0:
+            return features
+
+        idf = np.log(num_documents / np.maximum(df, 1.0))
+        features[:, 0] = np.dot(tf, qtf * idf)
+
+        #BM25 with the non-negative (Lucene) idf
+        bm25_idf = np.log(1.0 + (num_documents - df + 0.5) / (df + 0.5))
+        average_length = statistics.total_terms / max(num_documents, 1.0)
+        norm = k1 * (1.0 - b + b * lengths / max(average_length, 1e-9))
+        features[:, 1] = np.dot(tf * (k1 + 1.0) / (tf + norm[:, None]), qtf * bm25_idf)
+
+        #query likelihood with Dirichlet smoothing, over the query terms seen in the collection
+        seen = cf > 0
+        collection_probability = cf[seen] / max(statistics.total_terms, 1)
+        smoothed = (tf[:, seen] + mu * collection_probability) / (lengths[:, None] + mu)
+        features[:, 2] = np.dot(np.log(smoothed), qtf[seen])
+        return features
+
+
+def extract_query_features(statistics, query_text, docids, batch_size=DOCUMENT_BATCH_SIZE, k1=1.2, b=0.75, mu=2500.0):
+        '''
+            (indexed, features): the mask of the candidate documents (external ids) of a query
+            found in the index, and the (documents, features) matrix of these documents, the
+            document vectors being fetched batch_size documents at a time
+        '''
+        query_terms = statistics.get_query_terms(query_text)
+        int_doc_ids = statistics.get_document_ids(docids)
+        indexed = int_doc_ids > 0
+        int_doc_ids = int_doc_ids[indexed]
+
+        features = np.zeros((len(int_doc_ids), len(FEATURE_NAMES)))
+        for start in range(0, len(int_doc_ids), batch_size):
+            terms, lengths = statistics.get_document_vectors(int_doc_ids[start:start + batch_size])
+            tf = get_term_frequency_matrix(terms, lengths, query_terms[0])
+            features[start:start + batch_size] = get_retrieval_features(statistics, query_terms, tf, lengths, k1, b, mu)
+        return indexed, features
+
+
+def get_value_format(precision=None):
+        '''
+            format of one feature value, its shortest repr when no precision (number of
+            significant digits) is given, as tools.letor.get_feature_format
+        '''
+        if precision is None:
+            return '\t%r'
+        return '\t%.' + str(int(precision)) + 'g'
+
+
+def format_query_features(query_id, docids, features, precision=None):
+        '''
+            "query_id<TAB>docid<TAB>feature..." lines of the query-document feature file
+        '''
+        line_format = str(query_id).replace('%', '%%') + '\t%s' + get_value_format(precision) * features.shape[1] + '\n'
+        return ''.join([line_format % ((doc_id,) + tuple(row)) for doc_id, row in zip(docids, features.tolist())])
+
+
+_worker_statistics = None
+
+
+def _init_worker(index):
+        global _worker_statistics
+        if isinstance(index, str):
+            index = get_indri_index(index)
+        _worker_statistics = IndexStatistics(index)
+
+
+def _extract_query_features_worker(task):
+        query_id, query_text, docids, options, precision = task
+        indexed, features = extract_query_features(_worker_statistics, query_text, docids, *options)
+        #the candidates missing from the index are skipped rather than scored as empty documents
+        docids = [doc_id for doc_id, found in zip(docids, indexed.tolist()) if found]
+        return format_query_features(query_id, docids, features, precision), len(indexed) - len(docids)
+
+
+def extract_features(index, topics_path, run_path, output_path, depth=None, workers=1, batch_size=DOCUMENT_BATCH_SIZE,
+                     k1=1.2, b=0.75, mu=2500.0, precision=None):
+        '''
+            Write the query-document feature file (tf_idf, bm25, lm_dirichlet, doc_length) of the
+            candidate documents of a run (its depth first documents per query), for the topics
+            of the topics file, from an Indri index (path) or an in-memory index stand-in.
+            With several workers, the queries are shared out over a process pool, each worker
+            opening the index once, and the feature blocks are written in the query order.
+            The values are written with precision significant digits (default: their shortest
+            repr), and the candidate documents missing from the index are skipped with a warning.
+        '''
+        topicid_txt, topics_id = get_topics(topics_path)
+        run_result = get_run_result_arrays(run_path, depth=depth)
+        options = (batch_size, k1, b, mu)
+
+        tasks = []
+        for query_id in topics_id:
+            query_run = run_result.get_query_run(query_id)
+            if query_run is None:
+                continue
+            docids = run_result.vocabulary.documents.get_terms(query_run[1]).tolist()
+            tasks.append((query_id, topicid_txt[query_id], docids, options, precision))
+
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(index,))
+            query_features = pool.imap(_extract_query_features_worker, tasks)
+        else:
+            _init_worker(index)
+            query_features = map(_extract_query_features_worker, tasks)
+
+        missing_documents = 0
+        missing_queries = 0
+        try:
+            with open(output_path, 'w') as fw:
+                fw.write('\t'.join(['qid', 'docid'] + FEATURE_NAMES) + '\n')
+                for block, num_missing in query_features:
+                    fw.write(block)
+                    missing_documents += num_missing
+                    missing_queries += num_missing > 0
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if missing_documents > 0:
+            sys.stderr.write('extract: skipped %d candidate documents of %d queries missing from the index\n'
+                             % (missing_documents, missing_queries))
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description='Extract the query-document features of the documents of a run from an Indri index')
+        parser.add_argument('index_path')
+        parser.add_argument('topics_path', help='"topic_id:query" lines')
+        parser.add_argument('run_path')
+        parser.add_argument('output_path')
+        parser.add_argument('--depth', type=int, default=None, help='number of documents per query (default: all)')
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=DOCUMENT_BATCH_SIZE,
+                            help='number of document vectors fetched at a time')
+        parser.add_argument('--k1', type=float, default=1.2)
+        parser.add_argument('--b', type=float, default=0.75)
+        parser.add_argument('--mu', type=float, default=2500.0)
+        parser.add_argument('--precision', type=int, default=None,
+                            help='number of significant digits of the feature values (default: shortest repr)')
+        args = parser.parse_args(argv)
+
+        extract_features(args.index_path, args.topics_path, args.run_path, args.output_path, args.depth, args.workers,
+                         args.batch_size, args.k1, args.b, args.mu, args.precision)
+
+if __name__ == '__main__':
+        main()
@@ -0,0 +1,121 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from loader.run_result import get_run_results
+from loader.vocabulary import get_collection_vocabulary
+from prepare_ml_ranking import write_ranked_run, RUN_BUFFER_SIZE
+
+FUSION_METHODS = ['combsum', 'combmnz', 'rrf']
+SCORE_NORMALIZATIONS = ['none', 'minmax', 'sum', 'zmuv']
+#rank constant of the reciprocal rank fusion (Cormack et al., 2009)
+RRF_K = 60
+
+
+def get_normalized_scores(run_result, normalization='minmax'):
+        '''
+            float64 scores of a run normalized per query, for all the queries at once:
+            'minmax' to [0, 1] (1 when all the scores of a query are equal), 'sum' by the
+            sum of the min-shifted scores, 'zmuv' to zero mean and unit variance
+        '''
+        scores = run_result.scores.astype(np.float64)
+        if normalization == 'none' or len(scores) == 0:
+            return scores
+
+        starts = run_result.offsets[:-1]
+        counts = np.diff(run_result.offsets)
+        if normalization == 'zmuv':
+            means = np.add.reduceat(scores, starts) / counts
+            shifted = scores - np.repeat(means, counts)
+            stds = np.repeat(np.sqrt(np.add.reduceat(shifted * shifted, starts) / counts), counts)
+            return np.divide(shifted, stds, out=np.zeros_like(shifted), where=stds > 0)
+
+        shifted = scores - np.repeat(np.minimum.reduceat(scores, starts), counts)
+        if normalization == 'minmax':
+            ranges = np.repeat(np.maximum.reduceat(shifted, starts), counts)
+            return np.divide(shifted, ranges, out=np.ones_like(shifted), where=ranges > 0)
+        if normalization == 'sum':
+            sums = np.repeat(np.add.reduceat(shifted, starts), counts)
+            return np.divide(shifted, sums, out=np.ones_like(shifted) / np.repeat(counts, counts), where=sums > 0)
+        raise ValueError('unknown score normalization: ' + str(normalization))
+
+
+def get_fusion_inputs(run_result, method='combsum', normalization='minmax', rrf_k=RRF_K):
+        '''
+            per result values fused by the method: the normalized scores, or 1 / (rrf_k + rank)
+            for the reciprocal rank fusion, the rank being the position in the query ranking
+        '''
+        if method == 'rrf':
+            positions = np.arange(len(run_result.docids)) - np.repeat(run_result.offsets[:-1], np.diff(run_result.offsets))
+            return 1.0 / (rrf_k + 1.0 + positions)
+        return get_normalized_scores(run_result, normalization)
+
+
+def fuse_query(docids_list, values_list, method='combsum'):
+        '''
+            fuse the results of a query over several runs, joined on their interned docids:
+            the sum of the values (CombSUM, RRF), times the number of runs retrieving the
+            document for CombMNZ. Returns the fused docids and scores
+        '''
+        docids, inverse = np.unique(np.concatenate(docids_list), return_inverse=True)
+        values = np.concatenate(values_list)
+        fused = np.bincount(inverse, weights=values, minlength=len(docids))
+        if method == 'combmnz':
+            fused = fused * np.bincount(inverse, minlength=len(docids))
+        return docids, fused
+
+
+def fuse_runs(fw, run_results, method='combsum', normalization='minmax', tag=None, top_k=None, rrf_k=RRF_K):
+        '''
+            fuse runs loaded with get_run_results (sharing one vocabulary) and stream the
+            fused run, query by query, in TREC run format
+        '''
+        if method not in FUSION_METHODS:
+            raise ValueError('unknown fusion method: ' + str(method))
+        if not run_results:
+            return
+        vocabulary = run_results[0].vocabulary
+        runs_values = [get_fusion_inputs(run_result, method, normalization, rrf_k) for run_result in run_results]
+
+        query_ids = np.unique(np.concatenate([run_result.query_ids for run_result in run_results]))
+        for query_id in vocabulary.queries.get_terms(query_ids).tolist():
+            docids_list = []
+            values_list = []
+            for run_result, values in zip(run_results, runs_values):
+                idx = run_result.queryid_index.get(query_id)
+                if idx is not None:
+                    start = run_result.offsets[idx]
+                    end = run_result.offsets[idx + 1]
+                    docids_list.append(run_result.docids[start:end])
+                    values_list.append(values[start:end])
+
+            docids, fused = fuse_query(docids_list, values_list, method)
+            topic_docid_score = {query_id: (vocabulary.documents.get_terms(docids), fused)}
+            write_ranked_run(fw, [query_id], topic_docid_score, tag or method, top_k)
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description='Fuse TREC runs (CombSUM, CombMNZ or reciprocal rank fusion)')
+        parser.add_argument('output_path')
+        parser.add_argument('run_paths', nargs='+')
+        parser.add_argument('--method', choices=FUSION_METHODS, default='combsum')
+        parser.add_argument('--normalization', choices=SCORE_NORMALIZATIONS, default='minmax',
+                            help='per query score normalization of the runs (CombSUM and CombMNZ)')
+        parser.add_argument('--depth', type=int, default=None, help='number of results per query read from every run')
+        parser.add_argument('--top-k', type=int, default=None, help='number of results per query in the fused run')
+        parser.add_argument('--rrf-k', type=int, default=RRF_K)
+        parser.add_argument('--tag', default=None)
+        parser.add_argument('--vocabulary', default=None,
+                            help='path of the persisted collection vocabulary (<path>.qids and <path>.docids)')
+        args = parser.parse_args(argv)
+
+        vocabulary = get_collection_vocabulary(args.vocabulary)
+        run_results = get_run_results(args.run_paths, vocabulary, args.depth)
+        vocabulary.save()
+        with open(args.output_path, 'w', buffering=RUN_BUFFER_SIZE) as fw:
+            fuse_runs(fw, run_results, args.method, args.normalization, args.tag, args.top_k, args.rrf_k)
+
+if __name__ == '__main__':
+        main()
@@ -0,0 +1,68 @@
+import sys
+import importlib
+
+#subcommands of the pipeline: (module, description), the module of a subcommand
+#being imported only when it is run
+SUBCOMMANDS = {
+    'extract': ('extract_features', 'extract the query-document features of a run from an Indri index'),
+    'prepare': ('prepare_dataset', 'prepare the L2R training and testing datasets'),
+    'fold': ('prepare_folds', 'split the L2R datasets into cross-validation folds'),
+    'train': ('cross_validation', 'train and score the folds in process, and write the reranked run'),
+    'rerank': ('prepare_ml_ranking', 'write the reranked run from the fold predictions of an external learner'),
+    'eval': ('evaluate', 'evaluate runs against relevance judgements'),
+    'fuse': ('fuse', 'fuse TREC runs'),
+    'serve': ('rerank_service', 'serve a reranking model (JSON lines over TCP or a Unix socket)'),
+}
+SUBCOMMAND_ORDER = ['extract', 'prepare', 'fold', 'train', 'rerank', 'eval', 'fuse', 'serve']
+#separator of the stages chained in one invocation
+STAGE_SEPARATOR = '+'
+
+
+def get_usage():
+        lines = ['usage: l2r <subcommand> [arguments] [%s <subcommand> [arguments] ...]' % STAGE_SEPARATOR, '',
+                 'subcommands (l2r <subcommand> -h for their arguments):']
+        for name in SUBCOMMAND_ORDER:
+            lines.append('  %-8s %s' % (name, SUBCOMMANDS[name][1]))
+        return '\n'.join(lines) + '\n'
+
+
+def get_stages(argv):
+        '''
+            (subcommand, arguments) of the stages of a command line, separated by STAGE_SEPARATOR
+        '''
+        stages = [[]]
+        for arg in argv:
+            if arg == STAGE_SEPARATOR:
+                stages.append([])
+            else:
+                stages[-1].append(arg)
+        return [(stage[0], stage[1:]) if stage else (None, []) for stage in stages]
+
+
+def run_command(name, argv):
+        '''
+            run a subcommand with its arguments in the current process
+        '''
+        if name not in SUBCOMMANDS:
+            raise ValueError('unknown subcommand: ' + str(name))
+        module = importlib.import_module(SUBCOMMANDS[name][0])
+        module.main(list(argv))
+
+
+def main(argv=None):
+        argv = sys.argv[1:] if argv is None else argv
+        if not argv or argv[0] in ('-h', '--help'):
+            sys.stdout.write(get_usage())
+            return 0
+
+        stages = get_stages(argv)
+        for name, _ in stages:
+            if name not in SUBCOMMANDS:
+                sys.stderr.write(get_usage() + '\nl2r: unknown subcommand: %s\n' % name)
+                return 2
+        for name, args in stages:
+            run_command(name, args)
+        return 0
+
+if __name__ == '__main__':
+        sys.exit(main())
@@ -0,0 +1,139 @@
+import os
+import sys
+
+import numpy as np
+
+from loader.features import iter_query_doc_features
+from loader.vocabulary import Vocabulary, load_vocabulary
+from tools.cache import get_file_signature, get_cache_path, get_cache_build_dir, publish_cache_dir, remove_stale_caches
+
+
+#version of the layout of the cache entries, part of their key
+FEATURE_CACHE_VERSION = '2'
+#docid vocabulary of a cache entry, the ids of its docids.npy
+FEATURE_CACHE_VOCABULARY = 'vocabulary.docids'
+
+
+class FeatureCache(object):
+    '''
+        Compiled columnar copy of a query-document feature file: a memory-mapped
+        float32 feature matrix, the memory-mapped int32 docids (interned in the docid
+        vocabulary of the entry) and the query offset index (rows offsets[i]:offsets[i+1]
+        belong to query_ids[i]).
+        Given the collection vocabulary, the docids of the entry are also mapped to the
+        collection ids (get_docid_ids), to join them with the qrels and the runs.
+    '''
+
+    def __init__(self, cache_path, vocabulary=None):
+        self.path = cache_path
+        self.features = np.load(os.path.join(cache_path, 'features.npy'), mmap_mode='r')
+        self.docids = np.load(os.path.join(cache_path, 'docids.npy'), mmap_mode='r')
+        self.query_ids = np.load(os.path.join(cache_path, 'query_ids.npy'))
+        self.offsets = np.load(os.path.join(cache_path, 'offsets.npy'))
+        self.queryid_index = dict(zip(self.query_ids.tolist(), range(len(self.query_ids))))
+        self.documents = load_vocabulary(os.path.join(cache_path, FEATURE_CACHE_VOCABULARY))
+
+        #collection ids of the docids of the entry, None when they are the same ids
+        #(the collection vocabulary starting with the vocabulary of the entry)
+        self.docid_map = None
+        if vocabulary is not None and vocabulary.documents.terms[:len(self.documents)] != self.documents.terms:
+            self.docid_map = vocabulary.get_docids(self.documents.terms)
+
+    def __len__(self):
+        return len(self.query_ids)
+
+    def __iter__(self):
+        for idx in range(len(self.query_ids)):
+            yield self.get_block(idx)
+
+    def get_block(self, idx):
+        '''
+            (query_id, docids, features) of the idx-th query, as iter_query_doc_features yields it
+        '''
+        start = self.offsets[idx]
+        end = self.offsets[idx + 1]
+        return str(self.query_ids[idx]), self.documents.get_terms(self.docids[start:end]), self.features[start:end]
+
+    def get_docid_ids(self, idx):
+        '''
+            int32 docids of the idx-th query in the collection vocabulary given at opening
+        '''
+        docids = self.docids[self.offsets[idx]:self.offsets[idx + 1]]
+        if self.docid_map is None:
+            return np.asarray(docids)
+        return self.docid_map[docids]
+
+    def get_query_block(self, query_id):
+        '''
+            (query_id, docids, features) of a query, None if the query has no documents
+        '''
+        idx = self.queryid_index.get(query_id)
+        if idx is None:
+            return None
+        return self.get_block(idx)
+
+
+def get_feature_file_shape(path):
+        '''
+            number of rows (documents) and features of a query-document feature file
+        '''
+        num_rows = 0
+        num_features = 0
+        with open(path, 'r') as fread:
+            fread.readline()
+            for line in fread:
+                if not line.strip():
+                    continue
+                if num_rows == 0:
+                    num_features = len(line.rstrip().split("\t")) - 2
+                num_rows = num_rows + 1
+        return num_rows, num_features
+
+
+def build_feature_cache(path, cache_path):
+        '''
+            parse the feature file once and write its columnar copy in cache_path
+        '''
+        num_rows, num_features = get_feature_file_shape(path)
+        features = np.lib.format.open_memmap(os.path.join(cache_path, 'features.npy'), mode='w+',
+                                             dtype=np.float32, shape=(num_rows, num_features))
+        docids = np.lib.format.open_memmap(os.path.join(cache_path, 'docids.npy'), mode='w+',
+                                           dtype=np.int32, shape=(num_rows,))
+        documents = Vocabulary()
+        query_ids = []
+        offsets = [0]
+
+        for query_id, query_docids, query_features in iter_query_doc_features(path):
+            start = offsets[-1]
+            features[start:start + len(query_docids)] = query_features
+            docids[start:start + len(query_docids)] = documents.get_ids(query_docids)
+            query_ids.append(query_id)
+            offsets.append(start + len(query_docids))
+
+        features.flush()
+        docids.flush()
+        del features, docids
+        documents.save(os.path.join(cache_path, FEATURE_CACHE_VOCABULARY))
+        np.save(os.path.join(cache_path, 'query_ids.npy'), np.array(query_ids, dtype=np.str_))
+        np.save(os.path.join(cache_path, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+
+
+def get_feature_cache(path, cache_root=None, vocabulary=None):
+        '''
+            open the compiled cache of a feature file, building it on first use.
+            Entries are keyed on the path, size and mtime of the source file, so a
+            modified file invalidates (and removes) its previous cache, the caches of
+            other feature files sharing the cache root being kept. The docids of the
+            cache are mapped to the ids of the collection vocabulary, when given.
+        '''
+        if cache_root is None:
+            cache_root = path + '.cache'
+
+        cache_path = get_cache_path(cache_root, FEATURE_CACHE_VERSION + '\t' + get_file_signature(path))
+        if not os.path.isdir(cache_path):
+            build_dir = get_cache_build_dir(cache_root, path)
+            build_feature_cache(path, build_dir)
+            publish_cache_dir(build_dir, cache_path)
+            remove_stale_caches(cache_root, cache_path, path)
+
+        return FeatureCache(cache_path, vocabulary)
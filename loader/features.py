@@ -1,6 +1,8 @@
 import os
 import sys
 
+import numpy as np
+
 def get_letor_doc_features(path):
         with open(path, 'r') as fread:
             lines = fread.readlines()
@@ -90,4 +92,55 @@ def get_query_doc_features(path):
         return queryid_docids, queryid_docid_bm25, queryid_docid_features
 
 
+def _get_query_block(query_id, docids, rows):
+        '''
+            Convert the raw feature rows of one query into a float32 matrix
+        '''
+        try:
+            features = np.array('\t'.join(rows).split(), dtype=np.float32)
+        except ValueError:
+            raise ValueError('malformed feature rows for query ' + str(query_id))
+        num_features = features.size // len(rows)
+        if num_features * len(rows) != features.size:
+            raise ValueError('ragged or malformed feature rows for query ' + str(query_id))
+        return query_id, np.array(docids), features.reshape(len(rows), num_features)
+
+
+def iter_query_doc_features(path):
+        '''
+            Stream the query-document feature file one query at a time.
+            Rows have to be grouped by query id; every block is yielded as
+            (query_id, docids, features) where docids is a string array and
+            features a contiguous float32 matrix with one row per document,
+            so the memory in use is bounded by the largest query.
+        '''
+        seen_query_ids = set()
+        query_id = None
+        docids = []
+        rows = []
 
+        with open(path, 'r') as fread:
+            #skip the header line
+            fread.readline()
+
+            for line in fread:
+                line = line.rstrip()
+                if not line:
+                    continue
+                parts = line.split("\t", 2)
+
+                if parts[0] != query_id:
+                    if query_id is not None:
+                        yield _get_query_block(query_id, docids, rows)
+                    query_id = parts[0]
+                    if query_id in seen_query_ids:
+                        raise ValueError('rows of query ' + str(query_id) + ' are not grouped in ' + path)
+                    seen_query_ids.add(query_id)
+                    docids = []
+                    rows = []
+
+                docids.append(parts[1])
+                rows.append(parts[2])
+
+        if query_id is not None:
+            yield _get_query_block(query_id, docids, rows)
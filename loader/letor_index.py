@@ -0,0 +1,206 @@
+import os
+import io
+import sys
+import mmap
+
+from tools.cache import get_file_signature
+
+
+LETOR_INDEX_EXTENSION = '.idx'
+LETOR_QID_INDEX_EXTENSION = '.qidx'
+LETOR_MANIFEST_EXTENSION = '.manifest'
+#"qid<TAB>docid[<TAB>rank]" sidecar of a LETOR file, one line per sample
+LETOR_IDS_EXTENSION = '.ids'
+
+
+def get_qid_ranges(path, get_qid):
+        '''
+            index the byte ranges of the query blocks of a file in a single read:
+            {qid: [(offset, length), ...]} in the order of the file, adjacent lines of
+            the same query being merged into a single range
+        '''
+        qid_ranges = {}
+        offset = 0
+
+        with open(path, 'rb') as fread:
+            for line in fread:
+                qid = get_qid(line)
+                if qid is not None:
+                    ranges = qid_ranges.get(qid)
+                    if ranges is None:
+                        ranges = []
+                        qid_ranges[qid] = ranges
+                    if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+                        ranges[-1] = (ranges[-1][0], ranges[-1][1] + len(line))
+                    else:
+                        ranges.append((offset, len(line)))
+                offset = offset + len(line)
+
+        return qid_ranges
+
+
+def get_letor_line_qid(line):
+        parts = line.split(None, 2)
+        if len(parts) > 1 and parts[1].startswith(b'qid:'):
+            return parts[1][4:].decode('utf-8')
+        return None
+
+
+def get_ids_line_qid(line):
+        parts = line.split(None, 1)
+        if parts:
+            return parts[0].decode('utf-8')
+        return None
+
+
+def get_letor_qid_ranges(path):
+        '''
+            {qid: [(offset, length), ...]} of the query blocks of a LETOR file
+        '''
+        return get_qid_ranges(path, get_letor_line_qid)
+
+
+def get_ids_qid_ranges(path):
+        '''
+            {qid: [(offset, length), ...]} of the query blocks of an ids sidecar
+        '''
+        return get_qid_ranges(path, get_ids_line_qid)
+
+
+def get_letor_ranges(qid_ranges, qids):
+        '''
+            byte ranges of the given queries, in the order of the queries
+        '''
+        ranges = []
+        for qid in qids:
+            ranges.extend(qid_ranges.get(qid, []))
+        return ranges
+
+
+def write_letor_index(index_path, source_path, qids, qid_ranges):
+        '''
+            write the byte ranges of the given queries in source_path as a LETOR index file:
+            a "# path<TAB>size<TAB>mtime" header identifying the source file, then one
+            "qid<TAB>offset<TAB>length" line per range. The index is written atomically,
+            so a concurrent reader never sees a partial index
+        '''
+        tmp_path = index_path + '.tmp-' + str(os.getpid())
+        with open(tmp_path, 'w') as fw:
+            fw.write('# ' + get_file_signature(source_path) + '\n')
+            for qid in qids:
+                for offset, length in qid_ranges.get(qid, []):
+                    fw.write(str(qid) + '\t' + str(offset) + '\t' + str(length) + '\n')
+        os.replace(tmp_path, index_path)
+
+
+def read_letor_index(index_path):
+        '''
+            read a LETOR index file: the source path and its {qid: [(offset, length), ...]}.
+            An index whose source file changed since it was written is rejected.
+        '''
+        qid_ranges = {}
+        with open(index_path, 'r') as fr:
+            signature = fr.readline()[2:].rstrip('\n')
+            for line in fr:
+                qid, offset, length = line.rstrip('\n').split('\t')
+                ranges = qid_ranges.get(qid)
+                if ranges is None:
+                    ranges = []
+                    qid_ranges[qid] = ranges
+                ranges.append((int(offset), int(length)))
+
+        source_path = signature.split('\t')[0]
+        if not os.path.exists(source_path) or get_file_signature(source_path) != signature:
+            raise ValueError('the source of the LETOR index ' + index_path + ' changed: ' + source_path)
+        return source_path, qid_ranges
+
+
+def get_letor_qid_index(path):
+        '''
+            {qid: [(offset, length), ...]} of a LETOR file, read from its "<path>.qidx"
+            index, which is (re)built when missing or stale
+        '''
+        index_path = path + LETOR_QID_INDEX_EXTENSION
+        if os.path.exists(index_path):
+            try:
+                return read_letor_index(index_path)[1]
+            except ValueError:
+                pass
+
+        qid_ranges = get_letor_qid_ranges(path)
+        write_letor_index(index_path, path, list(qid_ranges.keys()), qid_ranges)
+        return qid_ranges
+
+
+def write_letor_manifest(manifest_path, source_path, qids):
+        '''
+            write a fold manifest: a "# source_path" header and the query ids of the fold,
+            resolved against the qid index of the source file when read (written atomically)
+        '''
+        tmp_path = manifest_path + '.tmp-' + str(os.getpid())
+        with open(tmp_path, 'w') as fw:
+            fw.write('# ' + os.path.abspath(source_path) + '\n')
+            for qid in qids:
+                fw.write(str(qid) + '\n')
+        os.replace(tmp_path, manifest_path)
+
+
+def read_letor_manifest(manifest_path):
+        '''
+            source path and byte ranges of the queries listed in a fold manifest
+        '''
+        with open(manifest_path, 'r') as fr:
+            source_path = fr.readline()[2:].rstrip('\n')
+            qids = [line.strip() for line in fr if line.strip()]
+        return source_path, get_letor_ranges(get_letor_qid_index(source_path), qids)
+
+
+def find_letor_view(path):
+        '''
+            the LETOR file itself when it exists, otherwise its index (.idx) or manifest view
+        '''
+        if os.path.exists(path):
+            return path
+        for extension in [LETOR_INDEX_EXTENSION, LETOR_MANIFEST_EXTENSION]:
+            if os.path.exists(path + extension):
+                return path + extension
+        return path
+
+
+def iter_letor_lines(path):
+        '''
+            iterate over the lines of a LETOR file or of a fold view of it (.idx or
+            .manifest), the view being read from the memory-mapped source file so the
+            fold data is never duplicated on disk
+        '''
+        path = find_letor_view(path)
+        if path.endswith(LETOR_INDEX_EXTENSION):
+            source_path, qid_ranges = read_letor_index(path)
+            ranges = [qid_range for qid in qid_ranges for qid_range in qid_ranges.get(qid)]
+        elif path.endswith(LETOR_MANIFEST_EXTENSION):
+            source_path, ranges = read_letor_manifest(path)
+        else:
+            with open(path, 'r') as fr:
+                for line in fr:
+                    yield line
+            return
+
+        if not ranges:
+            return
+        with open(source_path, 'rb') as fr, mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            for offset, length in ranges:
+                for line in io.StringIO(source[offset:offset + length].decode('utf-8'), newline=None):
+                    yield line
+
+
+def read_letor_ids(path):
+        '''
+            qid and docid columns of the "qid<TAB>docid[<TAB>rank]" sidecar of a LETOR file
+        '''
+        with open(path, 'r') as fr:
+            num_columns = len(fr.readline().split())
+            fr.seek(0)
+            tokens = fr.read().split()
+        if num_columns == 0:
+            return [], []
+        return tokens[0::num_columns], tokens[1::num_columns]
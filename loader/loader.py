@@ -33,5 +33,5 @@ def main():
         topics = get_topics(topics_path)
         #print (topics)
 
-
-main()
+if __name__ == '__main__':
+        main()
@@ -1,13 +1,21 @@
 import os
 import sys
 
-def get_qrels(path):
+import numpy as np
+
+from loader.vocabulary import read_columns, get_collection_vocabulary, get_pair_keys
+
+#grade returned by QrelsIndex.lookup for the documents that are not judged
+QRELS_UNJUDGED = np.iinfo(np.int8).min
+
+def get_qrels(path, skip_header=True):
 
         with open(path, 'r') as fread:
             lines = fread.readlines()
 
         queryid_docid_rel = {}
-        for idx in range(1, len(lines)):
+        #the first line of the qrels files is a dummy header judgement (e.g. "0 0 dummy 0")
+        for idx in range(1 if skip_header else 0, len(lines)):
             line = lines[idx]
             parts = line.rstrip().split(" ")
 
@@ -23,3 +31,109 @@ def get_qrels(path):
             queryid_docid_rel[query_id] = docid_rel
 
         return queryid_docid_rel
+
+
+def get_interned_qrels(path, vocabulary, skip_header=True):
+        '''
+            qrels as int32 query id and docid arrays (interned in the collection vocabulary)
+            and an int8 relevance array, in the order of the file
+        '''
+        query_ids, doc_ids, rels = read_columns(path, 4, skip_header, [0, 2, 3])
+        rels = np.array(rels, dtype=np.int64)
+        if len(rels) > 0 and (rels.min() <= QRELS_UNJUDGED or rels.max() > np.iinfo(np.int8).max):
+            raise ValueError('%s: relevance grades out of the int8 range' % path)
+        return vocabulary.get_query_ids(query_ids), vocabulary.get_docids(doc_ids), rels.astype(np.int8)
+
+
+class QrelsIndex(object):
+    '''
+        CSR index of the relevance judgements of a collection: the judged documents of
+        query_ids[i] are the sorted interned docids[offsets[i]:offsets[i+1]], with their
+        int8 relevance grades in grades[offsets[i]:offsets[i+1]].
+    '''
+
+    def __init__(self, query_ids, offsets, docids, grades, vocabulary):
+        self.query_ids = query_ids
+        self.offsets = offsets
+        self.docids = docids
+        self.grades = grades
+        self.vocabulary = vocabulary
+        self.queryid_index = dict(zip(vocabulary.queries.get_terms(query_ids).tolist(), range(len(query_ids))))
+
+    def __len__(self):
+        return len(self.query_ids)
+
+    def __contains__(self, query_id):
+        return query_id in self.queryid_index
+
+    def get_query_judgements(self, query_id):
+        '''
+            (interned docids, grades) of the judged documents of a query
+        '''
+        idx = self.queryid_index.get(query_id)
+        if idx is None:
+            return self.docids[:0], self.grades[:0]
+        start = self.offsets[idx]
+        end = self.offsets[idx + 1]
+        return self.docids[start:end], self.grades[start:end]
+
+    def lookup(self, query_id, docids):
+        '''
+            int8 grades of a list of documents (docid strings or interned ids) of a query,
+            QRELS_UNJUDGED for the documents that are not judged
+        '''
+        docids = np.asarray(docids)
+        if docids.dtype.kind not in 'iu':
+            docids = self.vocabulary.get_docids(docids, add=False)
+        grades = np.full(len(docids), QRELS_UNJUDGED, dtype=np.int8)
+
+        judged_docids, judged_grades = self.get_query_judgements(query_id)
+        if len(judged_docids) == 0 or len(docids) == 0:
+            return grades
+        positions = np.minimum(np.searchsorted(judged_docids, docids), len(judged_docids) - 1)
+        judged = judged_docids[positions] == docids
+        grades[judged] = judged_grades[positions[judged]]
+        return grades
+
+
+def get_qrels_index(path, vocabulary=None, skip_header=True, duplicates='last'):
+        '''
+            load the relevance judgements in a QrelsIndex, interning the ids in the collection
+            vocabulary. As get_qrels, the first line is skipped as a header unless skip_header
+            is False. A document judged more than once for a query keeps its 'last' (as in
+            get_qrels), 'first' or 'max' grade, or raises a ValueError with 'error'.
+        '''
+        if duplicates not in ['last', 'first', 'max', 'error']:
+            raise ValueError('unknown duplicate judgements policy: ' + str(duplicates))
+        if vocabulary is None:
+            vocabulary = get_collection_vocabulary()
+
+        query_ids, doc_ids, rels = get_interned_qrels(path, vocabulary, skip_header)
+
+        #judgements sorted by (query, docid) pair, the duplicates of a judgement by the kept one last
+        keys = get_pair_keys(query_ids, doc_ids)
+        if duplicates == 'max':
+            order = np.lexsort((rels, keys))
+        elif duplicates == 'first':
+            order = np.lexsort((-np.arange(len(rels)), keys))
+        else:
+            order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        query_ids = query_ids[order]
+        doc_ids = doc_ids[order]
+        rels = rels[order]
+
+        last = np.ones(len(rels), dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        if duplicates == 'error' and not last.all():
+            idx = np.flatnonzero(~last)[0]
+            raise ValueError('%s: duplicate judgement of %s for query %s' % (path, vocabulary.documents.get_terms([doc_ids[idx]])[0],
+                                                                            vocabulary.queries.get_terms([query_ids[idx]])[0]))
+        query_ids = query_ids[last]
+        doc_ids = doc_ids[last]
+        rels = rels[last]
+
+        index_query_ids, counts = np.unique(query_ids, return_counts=True)
+        offsets = np.zeros(len(index_query_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return QrelsIndex(index_query_ids.astype(np.int32), offsets, doc_ids, rels, vocabulary)
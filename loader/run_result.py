@@ -1,6 +1,10 @@
 import os
 import sys
 
+import numpy as np
+
+from loader.vocabulary import read_columns, get_collection_vocabulary
+
 def get_run_result(path):
 
         with open(path, 'r') as fread:
@@ -24,3 +28,131 @@ def get_run_result(path):
             queryid_docid_rankscore[query_id] = docid_rankscore
 
         return queryid_docid_rankscore
+
+
+def get_interned_run_result(path, vocabulary, skip_header=False, score_dtype=np.float32):
+        '''
+            TREC run as int32 query id and docid arrays (interned in the collection vocabulary),
+            an int32 rank array and a score array (float32 by default), in the order of the file
+        '''
+        query_ids, doc_ids, ranks, scores = read_columns(path, 6, skip_header, [0, 2, 3, 4])
+        return (vocabulary.get_query_ids(query_ids), vocabulary.get_docids(doc_ids),
+                np.array(ranks, dtype=np.int32), np.array(scores, dtype=score_dtype))
+
+
+class RunResult(object):
+    '''
+        Columnar TREC run: the results of query_ids[i] are the rows offsets[i]:offsets[i+1]
+        of the interned docid, int32 rank and float32 score arrays, ordered by rank.
+    '''
+
+    def __init__(self, query_ids, offsets, docids, ranks, scores, vocabulary, path=None):
+        self.path = path
+        self.query_ids = query_ids
+        self.offsets = offsets
+        self.docids = docids
+        self.ranks = ranks
+        self.scores = scores
+        self.vocabulary = vocabulary
+        self.queryid_index = dict(zip(vocabulary.queries.get_terms(query_ids).tolist(), range(len(query_ids))))
+
+    def __len__(self):
+        return len(self.query_ids)
+
+    def __contains__(self, query_id):
+        return query_id in self.queryid_index
+
+    def __iter__(self):
+        for idx in range(len(self.query_ids)):
+            yield self.get_block(idx)
+
+    def get_block(self, idx):
+        '''
+            (query_id, docids, ranks, scores) of the idx-th query
+        '''
+        start = self.offsets[idx]
+        end = self.offsets[idx + 1]
+        query_id = self.vocabulary.queries.terms[self.query_ids[idx]]
+        return query_id, self.docids[start:end], self.ranks[start:end], self.scores[start:end]
+
+    def get_query_run(self, query_id):
+        '''
+            (query_id, docids, ranks, scores) of a query, None if the query is not in the run
+        '''
+        idx = self.queryid_index.get(query_id)
+        if idx is None:
+            return None
+        return self.get_block(idx)
+
+    def lookup(self, query_id, docids, missing=-np.inf):
+        '''
+            float64 scores of a list of documents (docid strings or interned ids) of a query,
+            missing for the documents the run does not retrieve for the query
+        '''
+        docids = np.asarray(docids)
+        if docids.dtype.kind not in 'iu':
+            docids = self.vocabulary.get_docids(docids, add=False)
+        scores = np.full(len(docids), missing, dtype=np.float64)
+
+        query_run = self.get_query_run(query_id)
+        if query_run is None or len(docids) == 0:
+            return scores
+        _, run_docids, _, run_scores = query_run
+        order = np.argsort(run_docids, kind='stable')
+        sorted_docids = run_docids[order]
+        positions = np.minimum(np.searchsorted(sorted_docids, docids), len(sorted_docids) - 1)
+        retrieved = sorted_docids[positions] == docids
+        scores[retrieved] = run_scores[order[positions[retrieved]]]
+        return scores
+
+    def get_topics_docid_score(self):
+        '''
+            {query_id: (docid strings, scores)} of the run, as write_ranked_run takes it
+        '''
+        topics_docid_score = {}
+        for query_id, docids, _, scores in self:
+            topics_docid_score[query_id] = (self.vocabulary.documents.get_terms(docids), scores.astype(np.float64))
+        return topics_docid_score
+
+
+def get_run(query_ids, docids, ranks, scores, vocabulary, depth=None, path=None):
+        '''
+            RunResult of interned run columns, keeping the depth best ranked results per query
+            (all when depth is None); the results of equal rank keep their order
+        '''
+        order = np.lexsort((ranks, query_ids))
+        query_ids = query_ids[order]
+
+        run_query_ids, starts, counts = np.unique(query_ids, return_index=True, return_counts=True)
+        if depth is not None:
+            keep = np.arange(len(order)) - np.repeat(starts, counts) < depth
+            order = order[keep]
+            counts = np.minimum(counts, depth)
+
+        offsets = np.zeros(len(run_query_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return RunResult(run_query_ids.astype(np.int32), offsets, docids[order], ranks[order], scores[order], vocabulary, path)
+
+
+def get_run_results(paths, vocabulary=None, depth=None, skip_header=False, score_dtype=np.float32):
+        '''
+            load TREC run files into RunResults sharing one collection vocabulary, so that
+            their docids can be matched (e.g. for fusion) as integer arrays; every run is
+            truncated to depth results per query at load time when depth is given.
+            Unlike get_run_result, the first line of a run is not skipped unless skip_header.
+        '''
+        if vocabulary is None:
+            vocabulary = get_collection_vocabulary()
+
+        run_results = []
+        for path in paths:
+            query_ids, docids, ranks, scores = get_interned_run_result(path, vocabulary, skip_header, score_dtype)
+            run_results.append(get_run(query_ids, docids, ranks, scores, vocabulary, depth, path))
+        return run_results
+
+
+def get_run_result_arrays(path, vocabulary=None, depth=None, skip_header=False):
+        '''
+            RunResult of a single TREC run file
+        '''
+        return get_run_results([path], vocabulary, depth, skip_header)[0]
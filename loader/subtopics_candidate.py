@@ -83,4 +83,5 @@ def main():
         subtopics_path = os.path.join(folder_path, subtopics_name)
         get_subtopics(subtopics_path)
 
-main()
+if __name__ == '__main__':
+        main()
@@ -0,0 +1,163 @@
+import os
+import sys
+import itertools
+
+import numpy as np
+
+#vocabulary files of a collection, next to its vocabulary path
+QUERY_VOCABULARY_EXTENSION = '.qids'
+DOCUMENT_VOCABULARY_EXTENSION = '.docids'
+
+
+class Vocabulary(object):
+    '''
+        Interning of string identifiers (query ids or docids) to dense int32 ids, in
+        order of first appearance. The vocabulary is persisted as a text file with one
+        identifier per line, the line number being its id, so the ids stay stable as
+        long as the vocabulary is only appended to.
+    '''
+
+    def __init__(self, terms=None, path=None):
+        self.path = path
+        self.terms = []
+        self.term_ids = {}
+        self.term_array = None
+        self.num_saved = 0
+        for term in terms or []:
+            self.add(term)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.term_ids
+
+    def add(self, term):
+        '''
+            id of a term, interning it if it is new
+        '''
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = len(self.terms)
+            self.term_ids[term] = term_id
+            self.terms.append(term)
+            self.term_array = None
+        return term_id
+
+    def get_id(self, term, add=True):
+        '''
+            id of a term, -1 if it is unknown and not added
+        '''
+        if add:
+            return self.add(term)
+        return self.term_ids.get(term, -1)
+
+    def get_ids(self, terms, add=True):
+        '''
+            int32 ids of a sequence (or array) of terms with a single dictionary probe per
+            term, the new terms being interned afterwards in their order of appearance
+        '''
+        shape = (len(terms),)
+        if isinstance(terms, np.ndarray):
+            shape = terms.shape
+            terms = terms.ravel().tolist()
+        ids = np.fromiter(map(self.term_ids.get, terms, itertools.repeat(-1)), dtype=np.int32, count=len(terms))
+        if add:
+            for position in np.flatnonzero(ids < 0).tolist():
+                ids[position] = self.add(terms[position])
+        return ids.reshape(shape)
+
+    def get_terms(self, ids):
+        '''
+            string array of the terms of int ids
+        '''
+        if self.term_array is None:
+            self.term_array = np.array(self.terms, dtype=str)
+        return self.term_array[np.asarray(ids, dtype=np.int64)]
+
+    def save(self, path=None):
+        '''
+            write the vocabulary file (atomically), when it holds new terms
+        '''
+        path = path or self.path
+        if path == self.path and self.num_saved == len(self.terms) and os.path.exists(path):
+            return
+        tmp_path = path + '.tmp-' + str(os.getpid())
+        with open(tmp_path, 'w') as fw:
+            fw.write(''.join([term + '\n' for term in self.terms]))
+        os.replace(tmp_path, path)
+        if path == self.path:
+            self.num_saved = len(self.terms)
+
+
+def load_vocabulary(path):
+        '''
+            the vocabulary persisted at path, an empty one (to be saved there) if there is none
+        '''
+        vocabulary = Vocabulary(path=path)
+        if os.path.exists(path):
+            with open(path, 'r') as fread:
+                for line in fread:
+                    vocabulary.add(line.rstrip('\n'))
+            vocabulary.num_saved = len(vocabulary)
+        return vocabulary
+
+
+class CollectionVocabulary(object):
+    '''
+        Query id and docid vocabularies shared by all the loaders of a collection,
+        persisted as <path>.qids and <path>.docids
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        if path is None:
+            self.queries = Vocabulary()
+            self.documents = Vocabulary()
+        else:
+            self.queries = load_vocabulary(path + QUERY_VOCABULARY_EXTENSION)
+            self.documents = load_vocabulary(path + DOCUMENT_VOCABULARY_EXTENSION)
+
+    def get_query_ids(self, query_ids, add=True):
+        return self.queries.get_ids(query_ids, add)
+
+    def get_docids(self, docids, add=True):
+        return self.documents.get_ids(docids, add)
+
+    def save(self):
+        if self.path is not None:
+            self.queries.save()
+            self.documents.save()
+
+
+def get_collection_vocabulary(path=None):
+        '''
+            the collection vocabulary persisted at path (in memory only when path is None)
+        '''
+        return CollectionVocabulary(path)
+
+
+def read_columns(path, num_columns, skip_header=True, columns=None):
+        '''
+            whitespace separated columns of a file with a fixed number of columns per line,
+            as lists of strings (the first line is a header when skip_header); only the given
+            columns (indexes) are extracted, all of them when columns is None
+        '''
+        with open(path, 'r') as fread:
+            if skip_header:
+                fread.readline()
+            tokens = fread.read().split()
+
+        if len(tokens) % num_columns != 0:
+            raise ValueError('%s: lines are expected to have %d columns' % (path, num_columns))
+        if columns is None:
+            columns = range(num_columns)
+        return [tokens[column::num_columns] for column in columns]
+
+
+def get_pair_keys(query_ids, docids):
+        '''
+            int64 keys of (query id, docid) pairs of interned ids, to join qrels, runs and
+            features with sorted array lookups (np.searchsorted, np.isin)
+        '''
+        return (np.asarray(query_ids, dtype=np.int64) << 32) | np.asarray(docids, dtype=np.int64)
@@ -1,35 +1,287 @@
 import os
 import sys
-import pyltr
+import json
+import time
 import pickle
+import random
+import hashlib
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
 
-def training_ltr_model(ltr_train_file_path, ltr_validation_file_path, ltr_model_file_path):
+from loader.letor_index import iter_letor_lines, find_letor_view
+from tools.cache import get_cache_path, get_cache_build_dir, publish_cache_dir, remove_stale_caches
+
+LTR_DATASET_ARRAYS = ['X', 'y', 'qids', 'comments']
+COMPACT_MODEL_EXTENSION = '.npz'
+
+#default LambdaMART configuration, overridden by the parameters of a sweep configuration
+LTR_MODEL_PARAMS = {
+        'n_estimators': 500,
+        'learning_rate': 0.02,
+        'max_features': 0.5,
+        'query_subsample': 0.5,
+        'max_leaf_nodes': 10,
+        'min_samples_leaf': 32,
+        'verbose': 1,
+}
+
+#training and validation datasets of a sweep, shared with the (forked) sweep workers
+_sweep_datasets = None
+
+def get_letor_content_hash(path):
+        '''
+            hash of the content of a LETOR file, or of the lines of a fold view
+        '''
+        content_hash = hashlib.blake2b(digest_size=20)
+        view_path = find_letor_view(path)
+        if view_path == path:
+            with open(path, 'rb') as fr:
+                for chunk in iter(lambda: fr.read(1 << 20), b''):
+                    content_hash.update(chunk)
+        else:
+            for line in iter_letor_lines(view_path):
+                content_hash.update(line.encode('utf-8'))
+        return content_hash.hexdigest()
+
+def read_ltr_dataset(ltr_file_path, use_cache=True):
+        '''
+            parse a LETOR file (or fold view) into X, y, qids, comments with pyltr.
+            The arrays are cached in "<file>.dataset/", validated by the content hash of
+            the file, so repeated trainings skip the text parsing (X is memory-mapped)
+        '''
+        #pyltr (and scikit-learn) are only needed to parse and train, not to load and score
+        #the models, so the reranking workers start without them
+        import pyltr
+
+        if not use_cache:
+            return pyltr.data.letor.read_dataset(iter_letor_lines(ltr_file_path))
+
+        view_path = find_letor_view(ltr_file_path)
+        cache_root = view_path + '.dataset'
+        cache_path = get_cache_path(cache_root, get_letor_content_hash(ltr_file_path))
+        if not os.path.isdir(cache_path):
+            dataset = pyltr.data.letor.read_dataset(iter_letor_lines(ltr_file_path))
+            build_dir = get_cache_build_dir(cache_root, view_path)
+            for name, array in zip(LTR_DATASET_ARRAYS, dataset):
+                np.save(os.path.join(build_dir, name + '.npy'), array)
+            publish_cache_dir(build_dir, cache_path)
+            remove_stale_caches(cache_root, cache_path, view_path)
 
-        with open(ltr_train_file_path) as trainfile, \
-                open(ltr_validation_file_path) as valifile:
-            TX, Ty, Tqids, _ = pyltr.data.letor.read_dataset(trainfile)
-            VX, Vy, Vqids, _ = pyltr.data.letor.read_dataset(valifile)
+        return tuple(np.load(os.path.join(cache_path, name + '.npy'), mmap_mode='r' if name == 'X' else None)
+                     for name in LTR_DATASET_ARRAYS)
 
+def get_ltr_metric():
+        import pyltr
+        return pyltr.metrics.NDCG(k=20)
 
-        metric = pyltr.metrics.NDCG(k=20)
+def fit_ltr_model(TX, Ty, Tqids, VX, Vy, Vqids, params=None):
+        import pyltr
+
+        metric = get_ltr_metric()
         # Only needed if you want to perform validation (early stopping & trimming)
         monitor = pyltr.models.monitors.ValidationMonitor(
                 VX, Vy, Vqids, metric=metric, stop_after=250)
 
-        model = pyltr.models.LambdaMART(
-                metric=metric,
-                n_estimators=500,
-                learning_rate=0.02,
-                max_features=0.5,
-                query_subsample=0.5,
-                max_leaf_nodes=10,
-                min_samples_leaf=32,
-                verbose=1,
-        )
+        model_params = dict(LTR_MODEL_PARAMS)
+        if params is not None:
+            model_params.update(params)
+        model = pyltr.models.LambdaMART(metric=metric, **model_params)
         model.fit(TX, Ty, Tqids, monitor=monitor)
+        return model
+
+def training_ltr_model(ltr_train_file_path, ltr_validation_file_path, ltr_model_file_path):
+
+        #the train and validation files may be fold views (.idx/.manifest) over a LETOR file
+        TX, Ty, Tqids, _ = read_ltr_dataset(ltr_train_file_path)
+        VX, Vy, Vqids, _ = read_ltr_dataset(ltr_validation_file_path)
+
+        model = fit_ltr_model(TX, Ty, Tqids, VX, Vy, Vqids)
         pickle.dump(model, open(ltr_model_file_path, 'wb'))
 
 def loading_ltr_model(ltr_model_file_path):
 
+    #compact (flattened) ensembles are loaded without unpickling the scikit-learn trees
+    if ltr_model_file_path.endswith(COMPACT_MODEL_EXTENSION):
+        return CompactLTRModel(ltr_model_file_path)
     model = pickle.load(open(ltr_model_file_path, 'rb'))
     return model
+
+class CompactLTRModel(object):
+    '''
+        LambdaMART ensemble flattened into packed arrays: the nodes of all the trees are
+        stored one after the other (feature index, threshold, left/right child, leaf value
+        scaled by the learning rate), leaves pointing to themselves. predict() walks all
+        the trees of a batch of documents at once, one tree level per step.
+    '''
+
+    def __init__(self, path):
+        with np.load(path) as arrays:
+            self.feature = arrays['feature']
+            self.threshold = arrays['threshold']
+            self.left = arrays['left']
+            self.right = arrays['right']
+            self.value = arrays['value']
+            self.roots = arrays['roots']
+            self.max_depth = int(arrays['max_depth'])
+            self.n_features = int(arrays['n_features'])
+
+    def predict(self, X, batch_size=256):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        scores = np.zeros(X.shape[0])
+        for start in range(0, X.shape[0], batch_size):
+            batch = X[start:start + batch_size]
+            flat_batch = batch.ravel()
+            row_offsets = (np.arange(batch.shape[0], dtype=np.int64) * batch.shape[1])[:, None]
+            nodes = np.repeat(self.roots[None, :], batch.shape[0], axis=0)
+            for _ in range(self.max_depth):
+                go_left = flat_batch.take(row_offsets + self.feature.take(nodes)) <= self.threshold.take(nodes)
+                nodes = np.where(go_left, self.left.take(nodes), self.right.take(nodes))
+            scores[start:start + batch_size] = self.value.take(nodes).sum(axis=1)
+        return scores
+
+def export_compact_ltr_model(model, compact_model_file_path):
+        '''
+            flatten the trees of a trained LambdaMART model into a single .npz file
+        '''
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        max_depth = 0
+        offset = 0
+        for estimator in model.estimators_[:model.estimators_fitted_, 0]:
+            tree = estimator.tree_
+            node_ids = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            roots.append(offset)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, node_ids, tree.children_right) + offset)
+            values.append(np.where(is_leaf, tree.value[:, 0, 0] * model.learning_rate, 0.0))
+            max_depth = max(max_depth, tree.max_depth)
+            offset = offset + tree.node_count
+
+        np.savez(compact_model_file_path,
+                 feature=np.concatenate(features).astype(np.int32),
+                 threshold=np.concatenate(thresholds).astype(np.float64),
+                 left=np.concatenate(lefts).astype(np.int32),
+                 right=np.concatenate(rights).astype(np.int32),
+                 value=np.concatenate(values).astype(np.float64),
+                 roots=np.array(roots, dtype=np.int32),
+                 max_depth=np.array(max_depth),
+                 n_features=np.array(model.n_features))
+
+def export_ltr_model(ltr_model_file_path, compact_model_file_path=None):
+        '''
+            export a pickled model to its compact form, "<model>.npz" by default
+        '''
+        if compact_model_file_path is None:
+            compact_model_file_path = ltr_model_file_path + COMPACT_MODEL_EXTENSION
+        export_compact_ltr_model(loading_ltr_model(ltr_model_file_path), compact_model_file_path)
+        return compact_model_file_path
+
+def get_sweep_configurations(space, n_iter=None, seed=0):
+        '''
+            configurations of a search space ({parameter: [values]}): the full grid, or
+            n_iter distinct configurations drawn at random from it
+        '''
+        names = sorted(space.keys())
+        grid = [dict(zip(names, values)) for values in itertools.product(*[space.get(name) for name in names])]
+        if n_iter is None or n_iter >= len(grid):
+            return grid
+        return random.Random(seed).sample(grid, n_iter)
+
+def _fit_sweep_configuration(task):
+        idx, params = task
+        TX, Ty, Tqids, VX, Vy, Vqids = _sweep_datasets
+
+        start = time.time()
+        model = fit_ltr_model(TX, Ty, Tqids, VX, Vy, Vqids, params)
+        fit_time = time.time() - start
+        score = get_ltr_metric().calc_mean(Vqids, Vy, model.predict(VX))
+        return idx, params, score, fit_time, model.estimators_fitted_, model
+
+def sweep_ltr_model(ltr_train_file_path, ltr_validation_file_path, ltr_model_file_path, space, n_iter=None, workers=None, seed=0):
+        '''
+            Hyperparameter sweep of LambdaMART: every configuration of the search space is
+            trained (with early stopping on the validation set) by a pool of processes
+            sharing the datasets loaded once. The NDCG@20 on the validation set and the fit
+            time of each configuration are written in "<model>.sweep.tsv"; only the best
+            model is kept in memory while sweeping, and pickled in ltr_model_file_path
+        '''
+        global _sweep_datasets
+
+        configurations = get_sweep_configurations(space, n_iter, seed)
+        TX, Ty, Tqids, _ = read_ltr_dataset(ltr_train_file_path)
+        VX, Vy, Vqids, _ = read_ltr_dataset(ltr_validation_file_path)
+        _sweep_datasets = (TX, Ty, Tqids, VX, Vy, Vqids)
+
+        tasks = []
+        for idx, params in enumerate(configurations):
+            sweep_params = {'verbose': 0}
+            sweep_params.update(params)
+            tasks.append((idx, sweep_params))
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        pool = None
+        results = []
+        best = None
+        try:
+            if workers > 1:
+                pool = multiprocessing.get_context('fork').Pool(min(workers, len(tasks)))
+                fitted = pool.imap(_fit_sweep_configuration, tasks, chunksize=1)
+            else:
+                fitted = map(_fit_sweep_configuration, tasks)
+            #the results come in the configuration order, the first best configuration is kept
+            for idx, params, score, fit_time, n_estimators_fitted, model in fitted:
+                results.append((idx, params, score, fit_time, n_estimators_fitted))
+                if best is None or score > best[2]:
+                    best = (idx, params, score, model)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            _sweep_datasets = None
+
+        with open(ltr_model_file_path + '.sweep.tsv', 'w') as fw:
+            fw.write('\t'.join(['config', 'params', 'ndcg@20', 'fit_time', 'n_estimators_fitted', 'best']) + '\n')
+            for idx, params, score, fit_time, n_estimators_fitted in results:
+                fw.write(str(idx) + '\t' + json.dumps(params, sort_keys=True) + '\t' + str(score) + '\t' +
+                         str(fit_time) + '\t' + str(n_estimators_fitted) + '\t' + str(int(idx == best[0])) + '\n')
+        with open(ltr_model_file_path, 'wb') as fw:
+            pickle.dump(best[3], fw)
+        return best[1], best[2]
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description='Training a LambdaMART model, optionally with a hyperparameter sweep')
+        parser.add_argument('ltr_train_file_path')
+        parser.add_argument('ltr_validation_file_path')
+        parser.add_argument('ltr_model_file_path')
+        parser.add_argument('--sweep', default=None,
+                            help='JSON file of the search space ({"parameter": [values], ...})')
+        parser.add_argument('--n-iter', type=int, default=None,
+                            help='number of configurations drawn at random (default: the full grid)')
+        parser.add_argument('--workers', type=int, default=None)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--compact', action='store_true',
+                            help='also export the trained model to its compact form (<model>.npz)')
+        args = parser.parse_args(argv)
+
+        if args.sweep is None:
+            training_ltr_model(args.ltr_train_file_path, args.ltr_validation_file_path, args.ltr_model_file_path)
+            if args.compact:
+                export_ltr_model(args.ltr_model_file_path)
+            return
+
+        with open(args.sweep, 'r') as fr:
+            space = json.load(fr)
+        params, score = sweep_ltr_model(args.ltr_train_file_path, args.ltr_validation_file_path, args.ltr_model_file_path,
+                                        space, args.n_iter, args.workers, args.seed)
+        print ('best: {} ndcg@20={}'.format(json.dumps(params, sort_keys=True), score))
+        if args.compact:
+            export_ltr_model(args.ltr_model_file_path)
+
+if __name__ == '__main__':
+        main()
@@ -1,13 +1,22 @@
 import os
+import io
 import sys
+import argparse
+import contextlib
+import multiprocessing
 
-import random
 import numpy as np
 
-from loader.topics import *
-from loader.features import *
-from loader.qrels import *
-from tools.normalization import *
+from loader.topics import get_topics
+from loader.features import iter_query_doc_features
+from loader.feature_cache import FeatureCache, get_feature_cache
+from loader.qrels import QRELS_UNJUDGED, get_qrels_index
+from loader.vocabulary import get_collection_vocabulary
+from loader.run_result import get_run_result_arrays
+from tools.normalization import NORMALIZATION_MODES, get_feature_normalizer, get_normalization_stats
+from tools.letor import write_letor_block
+from tools.sampling import sample_training_rows, get_query_rng, SAMPLING_STRATEGIES
+from loader.letor_index import LETOR_IDS_EXTENSION
 
 
 def get_minmax_norm(features_mat, index):
@@ -19,393 +28,380 @@ def get_minmax_norm(features_mat, index):
     return features_normalized
 
 
-def get_docids_random_sampling(number, doc_ids):
+def get_minmax_norm_bounds(features_mat, features_min, features_max):
     '''
-        Randomly sample n unique items from a list
+        column-wise min-max normalization with the given column minima and maxima
+        (the same values as get_minmax_norm(features_mat, 0) for the actual bounds)
     '''
-    if len(doc_ids) < number:
-        number = len(doc_ids)
-    sampled_docids = random.sample(doc_ids, number)
-    return sampled_docids
+    with np.errstate(invalid='ignore', divide='ignore'):
+        features_normalized = (features_mat - features_min)/(features_max - features_min)
+    features_normalized[np.isnan(features_normalized)] = 0
+    return features_normalized
 
-def get_docids_lowranked(num_rel, doc_ids):
+
+def get_prefix_minmax(features_mat):
     '''
-        Take the document ids from the bottom ranked non-annotated documents
+        column minima and maxima of every prefix of the rows: row i holds the bounds
+        of the rows [0, i]
     '''
-    if len(doc_ids) < num_rel:
-        num_rel = len(doc_ids)
-
-    chosen_docids = doc_ids[-num_rel:]
-    return chosen_docids
+    return np.minimum.accumulate(features_mat, axis=0), np.maximum.accumulate(features_mat, axis=0)
 
 
-def get_docids_distribution(docids, docid_rel):
+def get_docids_distribution(docids, grades):
     '''
-        get the distribution of document ids
+        get the distribution of document ids, from the relevance grades of the documents
+        (QRELS_UNJUDGED for the non-annotated ones, see QrelsIndex.lookup)
     '''
-    rel_docids = []
-    irrel_docids = []
-    nonannot_docids = []
-
-    for doc_id in docids:
-        relevance_grade = docid_rel.get(doc_id)
-
-        if relevance_grade is None:
-            nonannot_docids.append(doc_id)
-        elif relevance_grade <= 0:
-            irrel_docids.append(doc_id)
-        elif relevance_grade > 0:
-            rel_docids.append(doc_id)
-        else:
-            nonannot_docids.append(doc_id)
+    if grades is None:
+        return [], [], np.asarray(docids).tolist()
+    docids = np.asarray(docids)
+    judged = grades != QRELS_UNJUDGED
+
+    rel_docids = docids[grades > 0].tolist()
+    irrel_docids = docids[judged & (grades <= 0)].tolist()
+    nonannot_docids = docids[~judged].tolist()
 
     return rel_docids, irrel_docids, nonannot_docids
 
 
-def query_document_relevance_stats(query_ids, queryid_docid_rel, queryid_docid_features, dist_file_path):
+def query_document_relevance_stats(query_id, grades, docids, docids_distribution=None):
     '''
         Analyzing the number of relevant, irrelevant, and non-annotated documents
-        in the relevance judgements and baseline retrieval
-    '''
-    queryid_annotation_dist = {}
-    for query_id in query_ids:
-        docid_rel = queryid_docid_rel.get(query_id)
-        docid_features = queryid_docid_features.get(query_id)
-
-        if docid_rel is None:
-            docid_rel = {}
-
-        docids = docid_features.keys()
-        relevant_docids, irrelevant_docids, nonannot_docids = get_docids_distribution(docids, docid_rel)
-        num_rel = len(relevant_docids)
-        num_irrel = len(irrelevant_docids)
-        num_non_annotated = len(nonannot_docids)
-        queryid_annotation_dist[query_id] = {'rel':num_rel, 'irrel':num_irrel, 'nonannotated':num_non_annotated}
-
-    did = ['rel','irrel','nonannotated']
-    header = ['query_id'] + did
-    with open(dist_file_path, 'w') as fr:
-        fr.write('\t'.join(header) + '\n')
-        for query_id in queryid_annotation_dist:
-            dist = queryid_annotation_dist.get(query_id)
-            nrel = dist.get(did[0])
-            nirel = dist.get(did[1])
-            nonannot = dist.get(did[2])
-            fr.write(str(query_id) + '\t' + str(nrel) + '\t' + str(nirel) + '\t' + str(nonannot) + '\n')
-        fr.close()
-
-
-def get_natural_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids):
+        in the relevance judgements and baseline retrieval of a query
     '''
-        get the document ids to constitute the training samples based on natural distribution,
-        that means, considering all the positive and negative available in the relevance
-        judgements.
-    '''
-    training_docids = relevant_docids
+    if docids_distribution is None:
+        docids_distribution = get_docids_distribution(docids, grades)
+    relevant_docids, irrelevant_docids, nonannot_docids = docids_distribution
     num_rel = len(relevant_docids)
     num_irrel = len(irrelevant_docids)
-    num_nonannot = len(nonannot_docids)
-
-    #if there is no irrelevant documents, then we choose an equal number of relevant documents from 
-    #the non-annotated documents 
-    if num_irrel == 0:
-        #sampled_docids = get_docids_random_sampling(num_rel, nonannot_docids)
-        lowranked_docids = get_docids_lowranked(num_rel, nonannot_docids)
-        training_docids.extend(lowranked_docids)
-    else:
-        training_docids.extend(irrelevant_docids)
-
-    return training_docids
+    num_non_annotated = len(nonannot_docids)
+    return str(query_id) + '\t' + str(num_rel) + '\t' + str(num_irrel) + '\t' + str(num_non_annotated) + '\n'
 
 
-def get_equal_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids):
+def preparing_training_samples(fw, dist_type, query_id, grades, docids, features, precision=None, sparse=False, rng=None,
+                               sampling='random', num_bands=4, normalizer=None, scores=None):
     '''
-        get the document ids to constitute the training samples based on equal distribution
-        that means, equal number of negative examples to postive examples
+        preparing the training samples of a query based on the distribution type, grades
+        being the relevance grades of the documents of the query (QrelsIndex.lookup) and
+        rng the NumPy generator of the negative sampling (see tools.sampling), scores the
+        baseline scores of the documents (RunResult.lookup) the 'hard' sampling ranks the
+        negative examples by. The features are normalized by the normalizer (FeatureNormalizer),
+        per query min-max by default
     '''
-    training_docids = relevant_docids
-    num_rel = len(relevant_docids)
-    num_irrel = len(irrelevant_docids)
-    num_nonannot = len(nonannot_docids)
-
-    #if there is no irrelevant documents, then we choose an equal number of relevant documents 
-    #from the non-annotated documents as irrelevant documents
-
-    if num_irrel == 0:
-#        sampled_docids = get_docids_random_sampling(num_rel, nonannot_docids)
-        lowranked_docids = get_docids_lowranked(num_rel, nonannot_docids)
-        sampled_docids = lowranked_docids
+    print (query_id)
+    judged = grades != QRELS_UNJUDGED
+    num_rel = np.count_nonzero(grades > 0)
+    print ("Rel:{}, Irel:{}, Nona:{}".format(num_rel, np.count_nonzero(judged) - num_rel, len(grades) - np.count_nonzero(judged)))
+
+    training_rows = sample_training_rows(grades, dist_type, rng, sampling, scores, num_bands)
+    if len(training_rows) == 0:
+        return
+
+    #non-annotated documents selected as irrelevant documents and negative grades
+    #of irrelevant documents are both graded 0
+    qds_rel = np.maximum(grades[training_rows], 0)
+
+    #normalize features (not samples, thus, column-wise (0 index))
+    qds_features = np.asarray(features[training_rows])
+    if normalizer is None:
+        qds_features_norm = get_minmax_norm(qds_features, 0)
     else:
-        sampled_docids = get_docids_random_sampling(num_rel, irrelevant_docids)
+        qds_features_norm = normalizer.normalize(qds_features)
 
-    training_docids.extend(sampled_docids)
-    return training_docids
+    write_letor_block(fw, query_id, qds_rel, qds_features_norm, docids[training_rows], precision, sparse)
 
 
-def get_double_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids):
+def preparing_testing_samples(fw, query_id, grades, docids, features, rrank, precision=None, sparse=False, fids=None,
+                              prefix_minmax=None, normalizer=None):
     '''
-        get two times more negative examples than postive examples
+        preparing the testing samples of a query based on natural distribution: only the
+        rrank first candidates of the baseline ranking (the order of the feature rows) are
+        kept, and normalized among themselves. Their "qid<TAB>docid<TAB>rank" lines are
+        written in the fids sidecar (aligned with the samples) if given. prefix_minmax are
+        the bounds of the rows prefixes (get_prefix_minmax), to prepare several depths cheaply
+        with the per query min-max normalization; the normalizer (FeatureNormalizer) may
+        select another normalization
     '''
-    training_docids = relevant_docids
-    num_rel = len(relevant_docids)
-    num_irrel = len(irrelevant_docids)
-    num_nonannot = len(nonannot_docids)
-
-    #if there is no irrelevant documents, then we choose an equal number of relevant documents 
-    # from the non-annotated documents as irrelevant documents
-    if num_irrel == 0:
-#        sampled_docids = get_docids_random_sampling(num_rel*2, nonannot_docids)
-        lowranked_docids = get_docids_lowranked(num_rel, nonannot_docids)
-        sampled_docids = lowranked_docids
+    depth = min(len(docids), int(rrank))
+    if depth <= 0:
+        return
+    docids_sel = docids[:depth].tolist()
+
+    #dummy relevance 0 for unjudged test data (and negative grades)
+    if grades is None:
+        qds_rel = np.zeros(depth, dtype=np.int8)
     else:
-        sampled_docids = get_docids_random_sampling(num_rel*2, irrelevant_docids)
+        qds_rel = np.maximum(grades[:depth], 0)
 
-    training_docids.extend(sampled_docids)
-    return training_docids
+    qds_features = np.asarray(features[:depth])
+    if normalizer is not None and not normalizer.is_per_query():
+        qds_features_norm = normalizer.normalize(qds_features)
+    elif prefix_minmax is None:
+        qds_features_norm = get_minmax_norm(qds_features, 0)
+    else:
+        qds_features_norm = get_minmax_norm_bounds(qds_features, prefix_minmax[0][depth - 1], prefix_minmax[1][depth - 1])
 
+    write_letor_block(fw, query_id, qds_rel, qds_features_norm, docids_sel, precision, sparse)
+    if fids is not None:
+        line_prefix = str(query_id) + '\t'
+        fids.write(''.join([line_prefix + doc_id + '\t' + str(rank) + '\n' for rank, doc_id in enumerate(docids_sel, 1)]))
 
-def get_triple_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids):
-    '''
-        get three times more negative examples than postive examples
-    '''
-    training_docids = relevant_docids
-    num_rel = len(relevant_docids)
-    num_irrel = len(irrelevant_docids)
-    num_nonannot = len(nonannot_docids)
-
-    #if there is no irrelevant documents, then we choose an equal number of relevant documents 
-    # from the non-annotated documents as irrelevant documents
-    if num_irrel == 0:
-#        sampled_docids = get_docids_random_sampling(num_rel*3, nonannot_docids)
-        lowranked_docids = get_docids_lowranked(num_rel, nonannot_docids)
-        sampled_docids = lowranked_docids
-    else:
-        sampled_docids = get_docids_random_sampling(num_rel*3, irrelevant_docids)
 
-    training_docids.extend(sampled_docids)
-    return training_docids
+def get_query_blocks(query_doc_features_path, use_feature_cache=False, feature_cache_root=None):
+        '''
+            iterate over the (query_id, docids, features) blocks of the feature file, either
+            by streaming the text file or from its compiled (memory-mapped) cache
+        '''
+        if use_feature_cache or feature_cache_root is not None:
+            return iter(get_feature_cache(query_doc_features_path, feature_cache_root))
+        return iter_query_doc_features(query_doc_features_path)
 
 
-def get_quadruple_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids):
-    '''
-        get three times more negative examples than postive examples
-    '''
-    training_docids = relevant_docids
-    num_rel = len(relevant_docids)
-    num_irrel = len(irrelevant_docids)
-    num_nonannot = len(nonannot_docids)
-
-    #if there is no irrelevant documents, then we choose an equal number of relevant documents 
-    # from the non-annotated documents as irrelevant documents
-    if num_irrel == 0:
-    #   sampled_docids = get_docids_random_sampling(num_rel*4, nonannot_docids)
-        lowranked_docids = get_docids_lowranked(num_rel, nonannot_docids)
-        sampled_docids = lowranked_docids
-    else:
-        sampled_docids = get_docids_random_sampling(num_rel*4, irrelevant_docids)
+def get_query_join_blocks(query_doc_features_path, vocabulary, use_feature_cache=False, feature_cache_root=None):
+        '''
+            iterate over the (query_id, docids, join docids, features) blocks of the feature file:
+            the join docids are the int32 ids of the docids in the collection vocabulary when
+            reading the feature cache, so the qrels and run lookups are searchsorted only, and
+            the docid strings themselves when streaming the text file
+        '''
+        if use_feature_cache or feature_cache_root is not None:
+            feature_cache = get_feature_cache(query_doc_features_path, feature_cache_root, vocabulary)
+            return ((query_id, docids, feature_cache.get_docid_ids(idx), features)
+                    for idx, (query_id, docids, features) in enumerate(feature_cache))
+        return ((query_id, docids, docids, features) for query_id, docids, features in iter_query_doc_features(query_doc_features_path))
 
-    training_docids.extend(sampled_docids)
-    return training_docids
 
-def get_hexaple_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids):
+def get_dataset_path(path, dist_type, rrank):
     '''
-        get three times more negative examples than postive examples
+        path of the training (or testing) file of a distribution type and a reranking depth
     '''
-    training_docids = relevant_docids
-    num_rel = len(relevant_docids)
-    num_irrel = len(irrelevant_docids)
-    num_nonannot = len(nonannot_docids)
-
-    #if there is no irrelevant documents, then we choose an equal number of relevant documents 
-    # from the non-annotated documents as irrelevant documents
-    if num_irrel == 0:
-        lowranked_docids = get_docids_lowranked(num_rel, nonannot_docids)
-        sampled_docids = lowranked_docids
-        #sampled_docids = get_docids_random_sampling(num_rel*8, nonannot_docids)
-    else:
-        sampled_docids = get_docids_random_sampling(num_rel*8, irrelevant_docids)
-
-    training_docids.extend(sampled_docids)
-    return training_docids
+    return path + '.' + dist_type + '.' + str(rrank)
 
 
-def preparing_training_samples(dist_type, query_ids, queryid_docid_rel, queryid_docids, queryid_docid_features, ltr_train_file_path):
+def prepare_query_samples(query_id, grades, docids, features, dist_types, rranks, precision=None, sparse=False, seed=0,
+                          sampling='random', num_bands=4, normalizer=None, scores=None):
     '''
-        preparing the training samples based on the distribution type
+        relevance analysis line, training samples per distribution type and testing
+        samples (with their ids sidecar lines) per reranking depth (LETOR text) of a query.
+        The negative sampling is seeded per query, so the samples do not depend on
+        the order (or the process) in which the queries are prepared. grades are the
+        relevance grades of the documents (None when the query is not judged), scores
+        their baseline run scores (None without baseline run)
     '''
-    with open(ltr_train_file_path, 'w') as fw:
-        for query_id in query_ids:
-            print (query_id)
-            docid_rel = queryid_docid_rel.get(query_id)
-            docids = queryid_docids.get(query_id)
-            docid_features = queryid_docid_features.get(query_id)
-
-            if docid_rel is None:
-                continue
-
-            #docids = docid_features.keys()
-            relevant_docids, irrelevant_docids, nonannot_docids = get_docids_distribution(docids, docid_rel)
-            print ("Rel:{}, Irel:{}, Nona:{}".format(len(relevant_docids), len(irrelevant_docids), len(nonannot_docids)))
-
-            if dist_type == 'equal_neg':
-                training_docids = get_equal_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids)
-
-            elif dist_type =='double_neg':
-                training_docids = get_double_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids)
-
-            elif dist_type =='triple_neg':
-                training_docids = get_triple_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids)
-
-            elif dist_type =='quadruple_neg':
-                training_docids = get_quadruple_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids)
-
-            elif dist_type =='hexaple_neg':
-                training_docids = get_hexaple_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids)
-
-            else:
-                training_docids = get_natural_negative_examples(relevant_docids, irrelevant_docids, nonannot_docids)
-
-            qds_rel = []
-            qds_features = []
-            for doc_id in training_docids:
-                rel = docid_rel.get(doc_id)
-                qd_feature = docid_features.get(doc_id)
-                #features = get_l2_normalize(raw_features)
-                qds_features.append(qd_feature)
-
-                #in case of non-annotated documents documents selected as irrelevant documents
-                if rel is None:
-                    rel = 0
-                #in case of negative grade for an irrelevant documents
-                if rel < 0:
-                    rel = 0
-
-                qds_rel.append(rel)
-
-            #normalize features (not samples, thus, column-wise (0 index))
-            qds_features_mat = np.matrix(qds_features)
-            qds_features_mat_norm = get_minmax_norm(qds_features_mat, 0)
-            #qds_features_mat_norm = qds_features_mat
-            qds_features_list_norm = qds_features_mat_norm.tolist()
-            #qds_features_list_norm = qds_features_mat.tolist()
-
-
-            for jdx in range(0, len(qds_rel)):
-                rel = qds_rel[jdx]
-                features = qds_features_list_norm[jdx]
-                doc_id = training_docids[jdx]
-
-                line = str(rel) + " " + "qid:"+str(query_id)
-                feature_id = 1
-                for idx in range(0, len(features)):
-                    feature_val = features[idx]
-                    line = line + " " + str(feature_id) + ":"+str(feature_val)
-                    feature_id = feature_id + 1
-                line = line + " # "+ str(doc_id)
-                fw.write(line+'\n')
-        #fw.close()
-
-
-def preparing_testing_samples(query_ids,queryid_docid_rel,queryid_docids,queryid_docid_features,rrank,ltr_test_file_path):
+    #query-document-relevance triple analysis
+    dist_line = query_document_relevance_stats(query_id, grades, docids)
+
+    #preparing the training dataset (only for the judged queries)
+    dist_train_samples = {}
+    for dist_type in dist_types:
+        ftr = io.StringIO()
+        if grades is not None:
+            rng = get_query_rng(seed, query_id)
+            preparing_training_samples(ftr, dist_type, query_id, grades, docids, features, precision, sparse, rng,
+                                       sampling, num_bands, normalizer, scores)
+        dist_train_samples[dist_type] = ftr.getvalue()
+
+    #preparing testing samples, every reranking depth from the same prefix of the candidates
+    max_depth = min(len(docids), max([int(rrank) for rrank in rranks]))
+    test_features = np.asarray(features[:max_depth])
+    prefix_minmax = get_prefix_minmax(test_features)
+    rrank_test_samples = {}
+    for rrank in rranks:
+        fte = io.StringIO()
+        fids = io.StringIO()
+        preparing_testing_samples(fte, query_id, grades, docids, test_features, rrank, precision, sparse, fids, prefix_minmax,
+                                  normalizer)
+        rrank_test_samples[rrank] = (fte.getvalue(), fids.getvalue())
+
+    return dist_line, dist_train_samples, rrank_test_samples
+
+
+_worker_feature_cache = None
+_worker_qrels_index = None
+_worker_baseline_run = None
+
+
+def _init_worker(cache_path, qrels_index, baseline_run):
+    global _worker_feature_cache, _worker_qrels_index, _worker_baseline_run
+    _worker_feature_cache = FeatureCache(cache_path, qrels_index.vocabulary)
+    _worker_qrels_index = qrels_index
+    _worker_baseline_run = baseline_run
+
+
+def get_query_grades(qrels_index, query_id, docids):
     '''
-        preparing the testing samples based on natural distribution
+        relevance grades of the documents of a query, None if the query is not judged
+    '''
+    if query_id not in qrels_index:
+        return None
+    return qrels_index.lookup(query_id, docids)
+
+
+def get_query_scores(baseline_run, query_id, docids):
     '''
-    with open(ltr_test_file_path, 'w') as fw:
-        for query_id in query_ids:
-            docid_rel = queryid_docid_rel.get(query_id)
-            docids = queryid_docids.get(query_id)
-            docid_features = queryid_docid_features.get(query_id)
-
-            if docid_rel is None:
-                docid_rel = {}
-
-            qds_rel = []
-            qds_features = []
-
-            docids_sel = []
-            total_docid = len(docids)
-            rrank = min(total_docid, int(rrank))
-
-            for doc_id in docids:
-                docids_sel.append(doc_id)
-                rel = docid_rel.get(doc_id)
-                raw_features = docid_features.get(doc_id)
-                #features = get_l2_normalize(raw_features)
-                features = raw_features
-                qds_features.append(features)
-
-                if rel is None:
-                    rel = 0 #dummy relevance for unjudged test data
-                if int(rel) < 0:
-                    rel = 0
-                qds_rel.append(rel)
-
-            qds_features_mat = np.matrix(qds_features)
-            qds_features_mat_norm = get_minmax_norm(qds_features_mat, 0)
-            qds_features_list_norm = qds_features_mat_norm.tolist()
-            #qds_features_list_norm = qds_features_mat.tolist()
-
-            for jdx in range(0, len(docids_sel)):
-                rel = qds_rel[jdx]
-                features = qds_features_list_norm[jdx]
-                doc_id = docids_sel[jdx]
-
-                line = str(rel) + " " + "qid:"+str(query_id)
-                feature_id = 1
-                for idx in range(0, len(features)):
-                    feature_val = features[idx]
-                    line = line + " " + str(feature_id) + ":"+str(feature_val)
-                    feature_id = feature_id + 1
-
-                line = line + " # "+ str(doc_id)
-                fw.write(line+'\n')
-        #fw.close()
-
-
-def prepare_dataset(topics_path,query_doc_features_path,qrels_file_path,dist_type,rrank, dist_file_path,ltr_train_file_path,ltr_test_file_path):
+        baseline scores of the documents of a query (-inf for the documents the run does not
+        retrieve), None without baseline run
+    '''
+    if baseline_run is None:
+        return None
+    return baseline_run.lookup(query_id, docids)
+
+
+def _prepare_query_samples_worker(task):
+    idx, options = task
+    query_id, docids, features = _worker_feature_cache.get_block(idx)
+    docid_ids = _worker_feature_cache.get_docid_ids(idx)
+    grades = get_query_grades(_worker_qrels_index, query_id, docid_ids)
+    scores = get_query_scores(_worker_baseline_run, query_id, docid_ids)
+    return prepare_query_samples(query_id, grades, docids, features, *options, scores=scores)
+
+
+def prepare_dataset(topics_path,query_doc_features_path,qrels_file_path,dist_types,rranks, dist_file_path,ltr_train_file_path,ltr_test_file_path,
+                    use_feature_cache=False,feature_cache_root=None,precision=None,sparse=False,workers=1,seed=0,
+                    sampling='random',num_bands=4,normalization='query_minmax',normalization_stats_path=None,
+                    vocabulary_path=None,baseline_run_path=None):
         '''
-            Preparing the learning to rank (L2R) datasets for training and testing model
+            Preparing the learning to rank (L2R) datasets for training and testing model.
+            The feature file is streamed one query at a time, thus the relevance analysis,
+            the training and the testing samples of every distribution type and reranking
+            depth are all written in a single pass (ltr_train_file_path and ltr_test_file_path
+            are suffixed with .<dist_type>.<rrank>). The testing samples of a query are its rrank
+            first candidates, and their qid, docid and baseline rank are also written, line
+            by line, in a "<test file>.ids" sidecar.
+            The negative examples of the training samples are drawn per query with a seeded
+            NumPy generator, by the sampling strategy of tools.sampling ('random', 'hard' or
+            'rank_band' over num_bands bands of the baseline ranking); the 'hard' sampling ranks
+            the negative examples by their scores in the baseline run at baseline_run_path.
+            The features are normalized by the normalization mode of tools.normalization; the
+            collection statistics of the global modes are read from normalization_stats_path,
+            or computed in a first pass over the feature file (and saved there) when they are
+            missing or were computed from another version of the feature file.
+            The query ids and docids of the relevance judgements, of the baseline run and of the
+            feature cache are interned in the collection vocabulary persisted at vocabulary_path
+            (in memory only when it is None).
+            With several workers, the queries are shared out over a process pool reading
+            the memory-mapped feature cache and the outputs are merged in the query order.
         '''
+        if sampling == 'hard' and baseline_run_path is None:
+            raise ValueError('the hard negative sampling needs the baseline run')
         topics, query_ids = get_topics(topics_path)
-        queryid_docid_rel = get_qrels(qrels_file_path)
-        queryid_docids, queryid_docids_bm25, queryid_docid_features = get_query_doc_features(query_doc_features_path)
+        vocabulary = get_collection_vocabulary(vocabulary_path)
+        qrels_index = get_qrels_index(qrels_file_path, vocabulary)
+        baseline_run = None
+        if baseline_run_path is not None:
+            baseline_run = get_run_result_arrays(baseline_run_path, vocabulary)
+        query_ids_sel = set(query_ids)
+        normalizer = None
+        if normalization != 'query_minmax':
+            query_blocks = None
+            if normalization in ['global_minmax', 'zscore'] and get_normalization_stats(normalization_stats_path,
+                                                                                        query_doc_features_path) is None:
+                query_blocks = get_query_blocks(query_doc_features_path, use_feature_cache or workers > 1, feature_cache_root)
+            normalizer = get_feature_normalizer(normalization, normalization_stats_path, query_blocks, query_doc_features_path)
+        options = (dist_types, rranks, precision, sparse, seed, sampling, num_bands, normalizer)
 
         #print ("total topics: ", query_ids)
 
-        print('relevance judgement analysis ...')
-        #query-document-relevance triple analysis
-        query_document_relevance_stats(query_ids, queryid_docid_rel, queryid_docid_features, dist_file_path)
-        print ('done')
-
-        print('preparing training samples ...')
-        #preparing the training dataset
-        preparing_training_samples(dist_type, query_ids, queryid_docid_rel, queryid_docids, queryid_docid_features, ltr_train_file_path)
-        print ('done')
-
-        print('preparing testing samples ...')
-        #preparing testing samples
-        preparing_testing_samples(query_ids, queryid_docid_rel, queryid_docids, queryid_docid_features, rrank, ltr_test_file_path)
+        print('preparing relevance judgement analysis, training and testing samples ...')
+        pool = None
+        if workers > 1:
+            #the docids of the cache are interned in the vocabulary before the workers are forked
+            feature_cache = get_feature_cache(query_doc_features_path, feature_cache_root, vocabulary)
+            vocabulary.save()
+            tasks = ((idx, options) for idx, query_id in enumerate(feature_cache.query_ids.tolist()) if query_id in query_ids_sel)
+            pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(feature_cache.path, qrels_index, baseline_run))
+            query_samples = pool.imap(_prepare_query_samples_worker, tasks, chunksize=4)
+        else:
+            query_blocks = get_query_join_blocks(query_doc_features_path, vocabulary, use_feature_cache, feature_cache_root)
+            vocabulary.save()
+            query_samples = (prepare_query_samples(query_id, get_query_grades(qrels_index, query_id, docid_ids), docids, features,
+                                                   *options, scores=get_query_scores(baseline_run, query_id, docid_ids))
+                             for query_id, docids, docid_ids, features in query_blocks if query_id in query_ids_sel)
+
+        try:
+            with contextlib.ExitStack() as stack:
+                fd = stack.enter_context(open(dist_file_path, 'w'))
+                dataset_files = []
+                for dist_type in dist_types:
+                    for rrank in rranks:
+                        ftr = stack.enter_context(open(get_dataset_path(ltr_train_file_path, dist_type, rrank), 'w'))
+                        test_path = get_dataset_path(ltr_test_file_path, dist_type, rrank)
+                        fte = stack.enter_context(open(test_path, 'w'))
+                        fids = stack.enter_context(open(test_path + LETOR_IDS_EXTENSION, 'w'))
+                        dataset_files.append((dist_type, rrank, ftr, fte, fids))
+                fd.write('\t'.join(['query_id', 'rel', 'irrel', 'nonannotated']) + '\n')
+
+                for dist_line, dist_train_samples, rrank_test_samples in query_samples:
+                    fd.write(dist_line)
+                    for dist_type, rrank, ftr, fte, fids in dataset_files:
+                        test_samples, test_ids = rrank_test_samples.get(rrank)
+                        ftr.write(dist_train_samples.get(dist_type))
+                        fte.write(test_samples)
+                        fids.write(test_ids)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
         print ('done')
 
 
-def main():
-        topics_path = sys.argv[1]
-        query_doc_features_path = sys.argv[2]
-        rel_judgment_path = sys.argv[3]
-        dist_type = sys.argv[4]
-        num_rrank = sys.argv[5]
-        dist_path = sys.argv[6]
-
-        training_path = sys.argv[7]
-        train_path = training_path + '.' + dist_type + '.' + str(num_rrank)
-
-        test_path = sys.argv[8]
-        test_path = test_path + '.' + dist_type + '.' + str(num_rrank)
+def get_arguments(argv):
+        parser = argparse.ArgumentParser(description='Preparing the learning to rank (L2R) training and testing datasets')
+        parser.add_argument('topics_path')
+        parser.add_argument('query_doc_features_path')
+        parser.add_argument('rel_judgment_path')
+        parser.add_argument('dist_type', help='distribution type(s) of the training samples, comma-separated')
+        parser.add_argument('num_rrank', help='reranking depth(s), comma-separated')
+        parser.add_argument('dist_path')
+        parser.add_argument('training_path')
+        parser.add_argument('test_path')
+        parser.add_argument('--feature-cache', action='store_true',
+                            help='read the features from their compiled memory-mapped cache (built on first use)')
+        parser.add_argument('--cache-dir', default=None,
+                            help='directory of the feature cache (default: <features file>.cache), implies --feature-cache')
+        parser.add_argument('--precision', type=int, default=None,
+                            help='number of significant digits of the feature values (default: shortest exact repr)')
+        parser.add_argument('--sparse', action='store_true',
+                            help='drop the zero-valued features (sparse SVMlight format)')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='number of processes preparing the queries (uses the feature cache)')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='seed of the negative sampling')
+        parser.add_argument('--sampling', choices=SAMPLING_STRATEGIES, default='random',
+                            help='negative sampling: uniform, hard (best scored in the baseline run) or stratified by rank band')
+        parser.add_argument('--baseline-run', default=None,
+                            help='TREC run of the candidate documents, whose scores rank the hard negative examples')
+        parser.add_argument('--rank-bands', type=int, default=4,
+                            help='number of bands of the baseline ranking of the rank_band sampling')
+        parser.add_argument('--normalization', choices=NORMALIZATION_MODES, default='query_minmax',
+                            help='feature normalization (per query min-max by default)')
+        parser.add_argument('--normalization-stats', default=None,
+                            help='collection statistics artifact (.npz) of the global normalizations, computed if missing')
+        parser.add_argument('--vocabulary', default=None,
+                            help='path of the persisted collection vocabulary (<path>.qids and <path>.docids)')
+        return parser.parse_args(argv)
+
+
+def main(argv=None):
+        args = get_arguments(argv)
+        if args.sampling == 'hard' and args.baseline_run is None:
+            sys.exit('--sampling hard needs the --baseline-run')
+        topics_path = args.topics_path
+        query_doc_features_path = args.query_doc_features_path
+        rel_judgment_path = args.rel_judgment_path
+        dist_types = args.dist_type.split(',')
+        num_rranks = args.num_rrank.split(',')
+        dist_path = args.dist_path
+
+        train_path = args.training_path
+        test_path = args.test_path
 
         print ("{}\n{}\n{}\n{}\n{}\n{}\n{}\n{}\n".format(topics_path, query_doc_features_path, rel_judgment_path,
-                                                         dist_type, num_rrank, dist_path, train_path, test_path))
-        prepare_dataset(topics_path, query_doc_features_path, rel_judgment_path, dist_type, num_rrank, dist_path,
-                        train_path, test_path)
+                                                         ','.join(dist_types), ','.join(num_rranks), dist_path, train_path, test_path))
+        prepare_dataset(topics_path, query_doc_features_path, rel_judgment_path, dist_types, num_rranks, dist_path,
+                        train_path, test_path, args.feature_cache, args.cache_dir,
+                        args.precision, args.sparse, args.workers, args.seed, args.sampling, args.rank_bands,
+                        args.normalization, args.normalization_stats, args.vocabulary, args.baseline_run)
 
 if __name__ == '__main__':
     main()
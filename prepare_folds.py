@@ -0,0 +1,98 @@
+import os
+import sys
+import mmap
+import argparse
+
+from loader.letor_index import get_letor_qid_ranges, get_letor_qid_index, get_ids_qid_ranges, get_letor_ranges, write_letor_index, \
+    write_letor_manifest, LETOR_INDEX_EXTENSION, LETOR_MANIFEST_EXTENSION, LETOR_IDS_EXTENSION
+
+
+def get_folds_query_ids(folds_folder, nfolds):
+        '''
+            query ids of each fold, read from the f1..fn files (one query id per line)
+        '''
+        folds_query_ids = []
+        for fold in range(1, nfolds + 1):
+            with open(os.path.join(folds_folder, 'f' + str(fold)), 'r') as fr:
+                query_ids = [line.strip() for line in fr if line.strip()]
+            folds_query_ids.append(query_ids)
+        return folds_query_ids
+
+
+def write_letor_ranges(source_path, ranges, output_path):
+        '''
+            copy the given byte ranges of the source file to the output file, sequentially
+        '''
+        with open(output_path, 'wb') as fw:
+            if os.path.getsize(source_path) == 0:
+                return
+            with open(source_path, 'rb') as fr, mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ) as source:
+                for offset, length in ranges:
+                    fw.write(source[offset:offset + length])
+
+
+def split_letor_folds(letor_path, folds_query_ids, output_folder, suffix, view=None):
+        '''
+            write the fold files of a LETOR file reading it only once: for fold k, the
+            "te" file holds the queries of fold k and the "tr" file those of all the other
+            folds (in the fold order). Instead of copying the data, the 'index' view writes
+            the byte ranges of each fold in a "<fold file>.idx" index and the 'manifest' view
+            writes the "<letor file>.qidx" qid index once and a "<fold file>.manifest" per fold.
+            The ids sidecar of the LETOR file, if any, is split along (and always copied).
+        '''
+        if view == 'manifest':
+            qid_ranges = get_letor_qid_index(letor_path)
+        else:
+            qid_ranges = get_letor_qid_ranges(letor_path)
+        name = os.path.basename(letor_path)
+        ids_path = letor_path + LETOR_IDS_EXTENSION
+        ids_qid_ranges = None
+        if os.path.exists(ids_path):
+            ids_qid_ranges = get_ids_qid_ranges(ids_path)
+
+        for fold in range(1, len(folds_query_ids) + 1):
+            if suffix == 'te':
+                qids = folds_query_ids[fold - 1]
+            else:
+                qids = [qid for other in range(1, len(folds_query_ids) + 1) if other != fold
+                        for qid in folds_query_ids[other - 1]]
+
+            fold_path = os.path.join(output_folder, name + '.f' + str(fold) + suffix)
+            if view == 'index':
+                write_letor_index(fold_path + LETOR_INDEX_EXTENSION, letor_path, qids, qid_ranges)
+            elif view == 'manifest':
+                write_letor_manifest(fold_path + LETOR_MANIFEST_EXTENSION, letor_path, qids)
+            else:
+                write_letor_ranges(letor_path, get_letor_ranges(qid_ranges, qids), fold_path)
+            if ids_qid_ranges is not None:
+                write_letor_ranges(ids_path, get_letor_ranges(ids_qid_ranges, qids), fold_path + LETOR_IDS_EXTENSION)
+
+
+def prepare_folds(train_path, test_path, folds_folder, train_folder, test_folder, nfolds=5, view=None):
+        '''
+            Splitting the training and testing datasets into the cross-validation folds
+        '''
+        folds_query_ids = get_folds_query_ids(folds_folder, nfolds)
+        split_letor_folds(train_path, folds_query_ids, train_folder, 'tr', view)
+        split_letor_folds(test_path, folds_query_ids, test_folder, 'te', view)
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description='Splitting the L2R datasets into cross-validation folds')
+        parser.add_argument('train_path')
+        parser.add_argument('test_path')
+        parser.add_argument('folds_folder', help='folder of the f1..fn query id files')
+        parser.add_argument('train_folder')
+        parser.add_argument('test_folder')
+        parser.add_argument('--nfolds', type=int, default=5)
+        parser.add_argument('--index-only', dest='view', action='store_const', const='index',
+                            help='write the byte ranges of the folds (.idx) instead of copying the data')
+        parser.add_argument('--manifest', dest='view', action='store_const', const='manifest',
+                            help='write a qid index of the datasets (.qidx) and fold manifests (.manifest) instead of copying the data')
+        args = parser.parse_args(argv)
+
+        prepare_folds(args.train_path, args.test_path, args.folds_folder, args.train_folder, args.test_folder,
+                      args.nfolds, args.view)
+
+if __name__ == '__main__':
+        main()
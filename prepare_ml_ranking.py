@@ -1,11 +1,12 @@
 import os
 import sys
+import argparse
 import operator
+import numpy as np
 
-from loader.topics import *
-from loader.features import *
-from loader.qrels import *
-from tools.normalization import *
+from loader.letor_index import iter_letor_lines, read_letor_ids, LETOR_IDS_EXTENSION
+
+RUN_BUFFER_SIZE = 1 << 20
 
 def get_topics_list(path):
         with open(path, 'r') as fr:
@@ -15,97 +16,150 @@ def get_topics_list(path):
         topics = [line.rstrip() for line in lines]
         return topics
 
-def align_topics_docid_mlscore(learner, test_data, test_pred):
-        topics_docid_score = {}
-        with open(test_data, 'r') as fr:
-            test_data_lines = fr.readlines()
-            fr.close()
-
+def read_prediction_scores(learner, test_pred):
+        '''
+            prediction scores of a learner, in the order of the test samples: a score per
+            line for svm, "qid<TAB>index<TAB>score" lines otherwise (RankLib)
+        '''
         with open(test_pred, 'r') as fr:
-            test_pred_lines = fr.readlines()
-            fr.close()
-
-        for itr in range(len(test_data_lines)):
-            line = test_data_lines[itr]
+            tokens = fr.read().split()
+
+        if learner != "svm":
+            tokens = tokens[2::3]
+        return np.array(tokens, dtype=np.float64)
+
+def read_test_ids(test_data):
+        '''
+            qid and docid of the test samples, from the ids sidecar of the test data
+            or else parsed from the test data lines
+        '''
+        ids_path = test_data + LETOR_IDS_EXTENSION
+        if os.path.exists(ids_path):
+            return read_letor_ids(ids_path)
+
+        qids = []
+        docids = []
+        #the test data may be a fold view (.idx/.manifest) over the LETOR test file
+        for line in iter_letor_lines(test_data):
             parts = line.rstrip().split("#")
+            qids.append(parts[0].split(" ")[1].split(":")[1])
+            docids.append(parts[1].strip())
+        return qids, docids
+
+def get_topics_docid_score(qids, docids, scores):
+        '''
+            group the documents and their scores by topic: {topic_id: (docids, scores)},
+            the documents of a topic keeping their order
+        '''
+        qids = np.asarray(qids)
+        docids = np.asarray(docids)
+        if len(qids) == 0:
+            return {}
+
+        topics, inverse = np.unique(qids, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.cumsum(np.bincount(inverse, minlength=len(topics)))[:-1]
+        return dict(zip(topics.tolist(), zip(np.split(docids[order], bounds), np.split(scores[order], bounds))))
 
-            part = parts[0]
-            sub_part = part.split(" ")
-            q_qid = sub_part[1]
-
-            qid = q_qid.split(":")[1]
-            docid = parts[1].strip()
-            pred_line = test_pred_lines[itr].rstrip()
-
-            if learner == "svm":
-                pred = pred_line
-            else:
-                pred = pred_line.split("\t")[2]
-
-            docid_score = topics_docid_score.get(qid)
+def align_topics_docid_mlscore(learner, test_data, test_pred):
+        '''
+            align the prediction scores with the test samples by position:
+            {topic_id: (docids, scores)}
+        '''
+        qids, docids = read_test_ids(test_data)
+        scores = read_prediction_scores(learner, test_pred)
+        if len(scores) != len(qids):
+            raise ValueError('%s: %d predictions for %d test samples' % (test_pred, len(scores), len(qids)))
+
+        return get_topics_docid_score(qids, docids, scores)
+
+def get_ranking(scores, top_k=None):
+        '''
+            positions of the top_k highest scores (all when top_k is None) by decreasing score,
+            equal scores keeping their original order; the top_k are selected with a partial sort
+        '''
+        if top_k is None or top_k >= len(scores):
+            return np.argsort(-scores, kind='stable')
+        if top_k <= 0:
+            return np.arange(0)
+        kth_score = scores[np.argpartition(-scores, top_k - 1)[top_k - 1]]
+        #among the documents scored as the k-th one, the first ones are kept (as a stable sort does)
+        above = np.flatnonzero(scores > kth_score)
+        ties = np.flatnonzero(scores == kth_score)[:top_k - len(above)]
+        top = np.concatenate([above, ties])
+        return top[np.lexsort((top, -scores[top]))]
+
+def write_ranked_run(fw, topics_id, topics_docid_score, learner, top_k=None):
+        '''
+            write the ranking of the topics, by decreasing prediction score, in TREC run format,
+            cut at top_k documents per topic; the lines of a topic are written in a single call
+        '''
+        line_format = '%s Q0 %s %d %r ' + learner.replace('%', '%%') + '\n'
+        for topic_id in topics_id:
+            docid_score = topics_docid_score.get(topic_id)
             if docid_score is None:
-                docid_score = {}
-            docid_score[docid] = float(pred)
-            topics_docid_score[qid] = docid_score
-
-        return topics_docid_score
-
-def prepare_ml_ranked(cmt_path, dist, rrank, learner, nfolds, input_folder, output_folder, run_folder):
-
-        run_path = os.path.join(run_folder, cmt_path+'_'+ dist + '_' + str(rrank) + '_' + learner+'_reranked.res')
-        with open(run_path, 'w') as fw:
+                print (topic_id)
+                continue
+
+            docids, scores = docid_score
+            ranking = get_ranking(scores, top_k)
+
+            topic_ids = [topic_id] * len(ranking)
+            ranked_docids = docids[ranking].tolist()
+            ranks = range(1, len(ranking) + 1)
+            fw.write(''.join(map(line_format.__mod__, zip(topic_ids, ranked_docids, ranks, scores[ranking].tolist()))))
+
+def get_run_path(run_folder, cmt_path, dist, rrank, learner):
+        return os.path.join(run_folder, cmt_path+'_'+ dist + '_' + str(rrank) + '_' + learner+'_reranked.res')
+
+def prepare_ml_ranked(cmt_path, dist, rrank, learner, nfolds, input_folder, output_folder, run_folder, folds_topics_docid_score=None,
+                      top_k=None):
+        '''
+            write the reranked run of the test folds, from the .pred files of the learner
+            or from the in-memory prediction scores of every fold ({topic_id: (docids, scores)}),
+            keeping the top_k documents of every topic (all when top_k is None)
+        '''
+        run_path = get_run_path(run_folder, cmt_path, dist, rrank, learner)
+        with open(run_path, 'w', buffering=RUN_BUFFER_SIZE) as fw:
             for f in range(1, (nfolds+1)):
                 topics_fold_path = os.path.join(input_folder, 'f'+str(f))
                 topics_id = get_topics_list(topics_fold_path)
-                test_data=os.path.join(output_folder,'test/'+cmt_path+'_query.ltr.test.'+dist+'.'+str(rrank)+'.f'+str(f)+'te')
-                test_pred=os.path.join(output_folder,'test/'+cmt_path+'_query.ltr.test.'+dist+'.'+str(rrank)+'.f'+str(f)+'te.'+learner+'.pred')
 
-                #aligning prediction score of test data
-                topics_docid_score = align_topics_docid_mlscore(learner, test_data, test_pred)
+                if folds_topics_docid_score is not None:
+                    topics_docid_score = folds_topics_docid_score[f - 1]
+                else:
+                    test_data=os.path.join(output_folder,'test/'+cmt_path+'_query.ltr.test.'+dist+'.'+str(rrank)+'.f'+str(f)+'te')
+                    test_pred=os.path.join(output_folder,'test/'+cmt_path+'_query.ltr.test.'+dist+'.'+str(rrank)+'.f'+str(f)+'te.'+learner+'.pred')
+
+                    #aligning prediction score of test data
+                    topics_docid_score = align_topics_docid_mlscore(learner, test_data, test_pred)
 
                 #writing the run file
-                for topic_id in topics_id:
-                    docid_score = topics_docid_score.get(topic_id)
-                    #sorted_docid_score = sorted(docid_score, key=sortSecond, reverse=True)
-                    #rank = 1
-                    #for docid, score in sorted_docid_score:
-                    #    line = str(topic_id)+' '+'Q0'+' '+str(docid)+' '+str(rank)+' '+str(score)+' svm-rank\n'
-                    #    rank = rank + 1
-                    #    fw.write(line)
-                    #
-                    if docid_score is None:
-                        print (topic_id)
-                        continue
-                    sorted_docids = sorted(docid_score, key=docid_score.get, reverse=True)
-                    rank = 1
-                    for docid in sorted_docids:
-                        score = docid_score.get(docid)
-                        line = str(topic_id)+' '+'Q0'+' '+str(docid)+' '+str(rank)+' '+str(score)+' '+learner+'\n'
-                        rank = rank + 1
-                        fw.write(line)
+                write_ranked_run(fw, topics_id, topics_docid_score, learner, top_k)
             fw.close()
 
 def sortSecond(val):
         return val[1]
 
-def main():
-        coll = sys.argv[1]
-        model = sys.argv[2]
-        topics = sys.argv[3]
-        dist = sys.argv[4]
-        rrank = sys.argv[5]
-        learner = sys.argv[6]
-        #nfolds = int(sys.argv[5])
-        nfolds = 5
-        #input_folder = sys.argv[6]
-        input_folder = "input/data"
-        #output_folder = sys.argv[7]
-        output_folder = "output/l2r-dataset"
-        #run_folder = sys.argv[8]
-        run_folder = "output/runs"
-
-        cmt_path = coll + '_' + model + '_' + topics
-        prepare_ml_ranked(cmt_path, dist, rrank, learner, nfolds, input_folder, output_folder, run_folder)
+def main(argv=None):
+        parser = argparse.ArgumentParser(description='Writing the reranked run of the test folds from the predictions of a learner')
+        parser.add_argument('coll')
+        parser.add_argument('model')
+        parser.add_argument('topics')
+        parser.add_argument('dist')
+        parser.add_argument('rrank')
+        parser.add_argument('learner')
+        parser.add_argument('--top-k', type=int, default=None,
+                            help='number of documents per topic in the reranked run (default: all)')
+        parser.add_argument('--nfolds', type=int, default=5)
+        parser.add_argument('--input-folder', default='input/data')
+        parser.add_argument('--output-folder', default='output/l2r-dataset')
+        parser.add_argument('--run-folder', default='output/runs')
+        args = parser.parse_args(argv)
+
+        cmt_path = args.coll + '_' + args.model + '_' + args.topics
+        prepare_ml_ranked(cmt_path, args.dist, args.rrank, args.learner, args.nfolds, args.input_folder, args.output_folder,
+                          args.run_folder, top_k=args.top_k)
 
 if __name__ == '__main__':
         main()
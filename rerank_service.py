@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+
+import numpy as np
+
+from models import loading_ltr_model
+from prepare_dataset import get_minmax_norm
+from tools.normalization import NORMALIZATION_MODES, get_feature_normalizer
+
+#maximum size of a request line (a query with its candidate documents and features)
+REQUEST_LIMIT = 1 << 26
+
+
+class RerankBatcher(object):
+    '''
+        Micro-batching of the reranking requests: the queries waiting at the same time
+        (up to max_batch_docs documents, or max_wait seconds after the first one) are
+        normalized (per query min-max, or by the given FeatureNormalizer as the datasets
+        were) and scored with a single predict call of the model
+    '''
+
+    def __init__(self, model, max_batch_docs=20000, max_wait=0.002, normalizer=None):
+        self.model = model
+        self.normalizer = normalizer
+        self.max_batch_docs = max_batch_docs
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+
+    async def rerank(self, docids, features):
+        '''
+            reranked document ids and scores of a query, from its raw features
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((docids, features, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            num_docs = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while num_docs < self.max_batch_docs:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                num_docs = num_docs + len(item[0])
+
+            await self.score(batch)
+
+    async def score(self, batch):
+        '''
+            score a batch of queries and resolve their futures; when the batch fails,
+            its queries are scored one by one so a faulty request only fails itself
+        '''
+        loop = asyncio.get_running_loop()
+        try:
+            batch_scores = await loop.run_in_executor(None, self.score_batch, [item[1] for item in batch])
+        except Exception as error:
+            if len(batch) > 1:
+                for item in batch:
+                    await self.score([item])
+            elif not batch[0][2].done():
+                batch[0][2].set_exception(error)
+            return
+
+        for (docids, _, future), scores in zip(batch, batch_scores):
+            if future.done():
+                continue
+            order = np.argsort(-scores, kind='stable')
+            future.set_result(([docids[idx] for idx in order.tolist()], scores[order].tolist()))
+
+    def score_batch(self, queries_features):
+        '''
+            normalization (as in prepare_dataset) and scoring of all the queries at once; with
+            collection-level statistics, the whole batch is normalized in a single call
+        '''
+        if self.normalizer is not None and not self.normalizer.is_per_query():
+            normalized = self.normalizer.normalize(np.concatenate(queries_features))
+        else:
+            normalized = np.concatenate([get_minmax_norm(features, 0) for features in queries_features])
+        scores = self.model.predict(normalized)
+        offsets = np.cumsum([len(features) for features in queries_features])[:-1]
+        return np.split(scores, offsets)
+
+
+async def handle_connection(batcher, reader, writer):
+    '''
+        JSON lines protocol: {"qid": ..., "docids": [...], "features": [[...], ...]} per request,
+        answered with {"qid": ..., "docids": [...], "scores": [...]} (or {"qid": ..., "error": ...})
+    '''
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            qid = None
+            try:
+                request = json.loads(line)
+                qid = request.get('qid')
+                docids = request.get('docids')
+                features = np.asarray(request.get('features'), dtype=np.float64)
+                if features.ndim != 2 or features.shape[0] != len(docids):
+                    raise ValueError('expecting one row of features per document')
+                num_features = getattr(batcher.model, 'n_features', None)
+                if num_features is not None and features.shape[1] != num_features:
+                    raise ValueError('expecting ' + str(num_features) + ' features per document')
+                if len(docids) == 0:
+                    response = {'qid': qid, 'docids': [], 'scores': []}
+                else:
+                    reranked_docids, scores = await batcher.rerank(docids, features)
+                    response = {'qid': qid, 'docids': reranked_docids, 'scores': scores}
+            except Exception as error:
+                response = {'qid': qid, 'error': str(error)}
+            writer.write((json.dumps(response) + '\n').encode('utf-8'))
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(model_path, socket_path=None, host='127.0.0.1', port=8765, max_batch_docs=20000, max_wait=0.002,
+                normalization='query_minmax', normalization_stats_path=None):
+    '''
+        Serving the reranking of the candidate documents of queries with a trained model,
+        on a Unix socket (socket_path) or on a TCP port. The features are normalized with the
+        normalization mode (and the statistics artifact) the training datasets were prepared with
+    '''
+    normalizer = get_feature_normalizer(normalization, normalization_stats_path)
+    batcher = RerankBatcher(loading_ltr_model(model_path), max_batch_docs, max_wait, normalizer)
+    batcher_task = asyncio.ensure_future(batcher.run())
+
+    def client_connected(reader, writer):
+        return handle_connection(batcher, reader, writer)
+
+    if socket_path is not None:
+        server = await asyncio.start_unix_server(client_connected, path=socket_path, limit=REQUEST_LIMIT)
+    else:
+        server = await asyncio.start_server(client_connected, host=host, port=port, limit=REQUEST_LIMIT)
+
+    print ('reranking service ready on {}'.format(socket_path if socket_path is not None else host + ':' + str(port)))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batcher_task.cancel()
+
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description='Online reranking service of a learning to rank model')
+        parser.add_argument('model_path', help='pickled or compact (.npz) model')
+        parser.add_argument('--socket', default=None, help='path of the Unix socket to listen on')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--max-batch-docs', type=int, default=20000,
+                            help='maximum number of documents scored in a batch')
+        parser.add_argument('--max-wait', type=float, default=0.002,
+                            help='maximum time (seconds) a request waits for other requests to batch with')
+        parser.add_argument('--normalization', choices=NORMALIZATION_MODES, default='query_minmax')
+        parser.add_argument('--normalization-stats', default=None,
+                            help='collection statistics artifact (.npz) of the global normalizations')
+        args = parser.parse_args(argv)
+
+        asyncio.run(serve(args.model_path, args.socket, args.host, args.port, args.max_batch_docs, args.max_wait,
+                          args.normalization, args.normalization_stats))
+
+if __name__ == '__main__':
+        main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+
+#file of a cache entry recording the source file it was built from
+CACHE_SOURCE_FILE = 'source'
+
+
+def get_file_signature(path):
+    '''
+        signature of a file (absolute path, size and modification time) used to key its caches
+    '''
+    stat = os.stat(path)
+    return os.path.abspath(path) + '\t' + str(stat.st_size) + '\t' + str(stat.st_mtime_ns)
+
+
+def get_cache_path(cache_root, key):
+    '''
+        directory of the cache entry for the given key under the cache root
+    '''
+    return os.path.join(cache_root, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+
+def get_cache_source(cache_path):
+    '''
+        absolute path of the source file of a cache entry, None if it is not recorded
+    '''
+    try:
+        with open(os.path.join(cache_path, CACHE_SOURCE_FILE), 'r') as fread:
+            return fread.read().rstrip('\n')
+    except OSError:
+        return None
+
+
+def get_cache_build_dir(cache_root, source):
+    '''
+        fresh temporary directory, next to the cache entries, to build a cache entry of
+        the source file in
+    '''
+    os.makedirs(cache_root, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix='.tmp-', dir=cache_root)
+    os.chmod(build_dir, 0o755)
+    with open(os.path.join(build_dir, CACHE_SOURCE_FILE), 'w') as fw:
+        fw.write(os.path.abspath(source) + '\n')
+    return build_dir
+
+
+def publish_cache_dir(build_dir, cache_path):
+    '''
+        atomically move a freshly built cache entry in place, the entry of a concurrent
+        process that was published first is kept
+    '''
+    try:
+        os.rename(build_dir, cache_path)
+    except OSError:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        if not os.path.isdir(cache_path):
+            raise
+
+
+def remove_stale_caches(cache_root, cache_path, source):
+    '''
+        remove the entries of the cache root built from the same source file as the
+        current one (invalidated entries), the entries of other sources sharing the
+        cache root being kept
+    '''
+    source = os.path.abspath(source)
+    for name in os.listdir(cache_root):
+        path = os.path.join(cache_root, name)
+        if name.startswith('.tmp-') or path == cache_path or not os.path.isdir(path):
+            continue
+        if get_cache_source(path) == source:
+            shutil.rmtree(path, ignore_errors=True)
@@ -1,6 +1,133 @@
-import pyndri
+import re
+import itertools
+
+import numpy as np
+
 
 def get_indri_index(index_path):
 
+    #pyndri is only needed to read actual Indri indexes (not the in-memory stand-in)
+    import pyndri
+
     index = pyndri.Index(index_path)
     return index
+
+
+class MemoryIndex(object):
+    '''
+        In-memory stand-in of a pyndri.Index over {ext_document_id: text}, exposing the
+        part of the pyndri API used by IndexStatistics (no stemming nor stopping,
+        term ids starting at 1 and internal document ids at document_base()).
+    '''
+
+    def __init__(self, documents):
+        self.token2id = {}
+        self.id2df = {}
+        self.id2tf = {}
+        self.ext_ids = []
+        self.documents = []
+        for ext_id, text in documents.items():
+            term_ids = tuple([self.token2id.setdefault(token, len(self.token2id) + 1) for token in self.tokenize(text)])
+            for term_id in term_ids:
+                self.id2tf[term_id] = self.id2tf.get(term_id, 0) + 1
+            for term_id in set(term_ids):
+                self.id2df[term_id] = self.id2df.get(term_id, 0) + 1
+            self.ext_ids.append(ext_id)
+            self.documents.append(term_ids)
+        self.ext_id_index = dict(zip(self.ext_ids, range(self.document_base(), self.maximum_document())))
+
+    def tokenize(self, text):
+        return re.findall(r'\w+', text.lower())
+
+    def document_base(self):
+        return 1
+
+    def maximum_document(self):
+        return len(self.documents) + 1
+
+    def document(self, int_doc_id):
+        return self.ext_ids[int_doc_id - 1], self.documents[int_doc_id - 1]
+
+    def document_ids(self, ext_ids):
+        return tuple([(ext_id, self.ext_id_index[ext_id]) for ext_id in ext_ids if ext_id in self.ext_id_index])
+
+    def get_dictionary(self):
+        id2token = dict([(term_id, token) for token, term_id in self.token2id.items()])
+        return self.token2id, id2token, self.id2df
+
+    def get_term_frequencies(self):
+        return self.id2tf
+
+
+class IndexStatistics(object):
+    '''
+        Term, collection and document statistics of an index (pyndri.Index or MemoryIndex)
+        for feature extraction: the collection statistics are read once, the statistics of
+        the query terms once per distinct query, and the document vectors in batches.
+    '''
+
+    def __init__(self, index):
+        self.index = index
+        self.token2id, _, self.id2df = index.get_dictionary()
+        self.id2tf = index.get_term_frequencies()
+        self.num_documents = index.maximum_document() - index.document_base()
+        self.total_terms = sum(self.id2tf.values())
+        self.query_terms = {}
+
+    def get_query_terms(self, query_text):
+        '''
+            (term ids, query term frequencies, document frequencies, collection frequencies)
+            of the distinct in-vocabulary terms of a query, cached per query text
+        '''
+        query_terms = self.query_terms.get(query_text)
+        if query_terms is not None:
+            return query_terms
+
+        tokens = self.index.tokenize(query_text)
+        #stemming and stopping as configured in the Indri index (pyndri >= 0.4)
+        process_term = getattr(self.index, 'process_term', None)
+        if process_term is not None:
+            tokens = [process_term(token) for token in tokens]
+        term_ids = [self.token2id[token] for token in tokens if token and token in self.token2id]
+
+        term_ids, qtf = np.unique(np.array(term_ids, dtype=np.int64), return_counts=True)
+        df = np.array([self.id2df.get(term_id, 0) for term_id in term_ids.tolist()], dtype=np.float64)
+        cf = np.array([self.id2tf.get(term_id, 0) for term_id in term_ids.tolist()], dtype=np.float64)
+        query_terms = (term_ids, qtf.astype(np.float64), df, cf)
+        self.query_terms[query_text] = query_terms
+        return query_terms
+
+    def get_document_ids(self, ext_ids):
+        '''
+            internal ids of documents, 0 for the documents missing from the index
+        '''
+        ext_id_index = dict(self.index.document_ids(list(ext_ids)))
+        return np.array([ext_id_index.get(ext_id, 0) for ext_id in ext_ids], dtype=np.int64)
+
+    def get_document_vectors(self, int_doc_ids):
+        '''
+            term ids of a batch of documents, concatenated, and the lengths of the documents
+            (a missing document, internal id 0, is empty)
+        '''
+        vectors = [self.index.document(int_doc_id)[1] if int_doc_id > 0 else () for int_doc_id in int_doc_ids.tolist()]
+        lengths = np.array([len(vector) for vector in vectors], dtype=np.int64)
+        terms = np.fromiter(itertools.chain.from_iterable(vectors), dtype=np.int64, count=int(lengths.sum()))
+        return terms, lengths
+
+
+def get_term_frequency_matrix(terms, lengths, query_term_ids):
+        '''
+            (documents, query terms) frequency matrix of a batch of document vectors
+        '''
+        num_docs = len(lengths)
+        num_terms = len(query_term_ids)
+        if num_terms == 0 or len(terms) == 0:
+            return np.zeros((num_docs, num_terms))
+
+        doc_index = np.repeat(np.arange(num_docs), lengths)
+        order = np.argsort(query_term_ids)
+        sorted_term_ids = query_term_ids[order]
+        positions = np.minimum(np.searchsorted(sorted_term_ids, terms), num_terms - 1)
+        match = sorted_term_ids[positions] == terms
+        cells = doc_index[match] * num_terms + order[positions[match]]
+        return np.bincount(cells, minlength=num_docs * num_terms).reshape(num_docs, num_terms).astype(np.float64)
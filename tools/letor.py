@@ -0,0 +1,67 @@
+import os
+import sys
+import numpy as np
+
+
+def get_feature_format(precision=None):
+        '''
+            format of one "feature_id:value" pair, the shortest repr of the value (in its
+            own float dtype) when no precision (number of significant digits) is given
+        '''
+        if precision is None:
+            return ' %d:%s'
+        return ' %d:%.' + str(int(precision)) + 'g'
+
+
+def format_letor_block(query_id, rels, features, docids, precision=None, sparse=False):
+        '''
+            format the samples of a query as LETOR/SVMrank lines
+            ("rel qid:query_id 1:v1 2:v2 ... # docid") in one formatting call.
+            With sparse, zero-valued features are dropped (SVMlight sparse format).
+        '''
+        features = np.asarray(features)
+        num_docs = features.shape[0]
+        if num_docs == 0:
+            return ''
+
+        if sparse:
+            rows, cols = np.nonzero(features)
+        else:
+            rows = np.repeat(np.arange(num_docs), features.shape[1])
+            cols = np.tile(np.arange(features.shape[1]), num_docs)
+        counts = np.bincount(rows, minlength=num_docs)
+
+        #preallocated buffer of the values of the block: rel, (feature_id, value)*, docid per line
+        sizes = 2 + 2 * counts
+        starts = np.cumsum(sizes) - sizes
+        values = np.empty(int(sizes.sum()), dtype=object)
+        values[starts] = np.asarray(rels).tolist()
+        values[starts + sizes - 1] = [str(doc_id) for doc_id in docids]
+
+        pair_positions = starts[rows] + 1 + 2 * (np.arange(len(rows)) - (np.cumsum(counts) - counts)[rows])
+        values[pair_positions] = (cols + 1).tolist()
+        feature_values = features[rows, cols]
+        if precision is None and feature_values.dtype == np.float32:
+            #shortest repr of the float32 values, not of their float64 conversion
+            feature_values = feature_values.astype(str)
+        values[pair_positions + 1] = feature_values.tolist()
+
+        line_prefix = '%d qid:' + str(query_id).replace('%', '%%')
+        feature_format = get_feature_format(precision)
+        line_formats = {}
+        block_format = []
+        for count in counts.tolist():
+            line_format = line_formats.get(count)
+            if line_format is None:
+                line_format = line_prefix + feature_format * count + ' # %s\n'
+                line_formats[count] = line_format
+            block_format.append(line_format)
+
+        return ''.join(block_format) % tuple(values)
+
+
+def write_letor_block(fw, query_id, rels, features, docids, precision=None, sparse=False):
+        '''
+            write the samples of a query in LETOR/SVMrank format
+        '''
+        fw.write(format_letor_block(query_id, rels, features, docids, precision, sparse))
@@ -1,24 +1,196 @@
 import os
 import sys
 import numpy as np
-from sklearn import preprocessing
 
+from tools.cache import get_file_signature
 
-def get_max_normalize(features):
 
-        maximum = max(features)
-        norm_features = []
+def normalize_rows(features, norm='l2', nan_safe=True):
+        '''
+            normalize every row of a 2-D float block (float32 or float64) in place by its
+            L1, L2 or max (absolute) norm, in a single vectorized pass; the NaN values are
+            zeroed first when nan_safe, and all-zero rows are left as they are
+        '''
+        if not isinstance(features, np.ndarray) or features.ndim != 2 or not np.issubdtype(features.dtype, np.floating):
+            raise ValueError('expecting a 2-D float array to normalize in place')
+        if nan_safe:
+            features[np.isnan(features)] = 0.0
+
+        if norm == 'l1':
+            scale = np.abs(features).sum(axis=1)
+        elif norm == 'l2':
+            scale = np.sqrt(np.einsum('ij,ij->i', features, features))
+        elif norm == 'max':
+            scale = np.abs(features).max(axis=1, initial=0.0)
+        else:
+            raise ValueError('unknown row norm: ' + str(norm))
+        scale[scale == 0] = 1.0
+        features /= scale[:, None]
+        return features
 
-        for feature in features:
-            norm_feature = feature/maximum
-            norm_features.append(norm_feature)
 
-        return norm_features
+def get_max_normalize(features):
+        np_features = np.array(features, dtype=np.float64).reshape(1, -1)
+        return normalize_rows(np_features, 'max')[0].tolist()
 
 
 def get_l2_normalize(features):
-        np_features = np.asarray(features)
-        #print (np_features)
-        np_features[np.isnan(np_features)] = 0.0
-        X_normalized = preprocessing.normalize(np_features.reshape(1,-1), norm='l2')
-        return X_normalized[0]
+        np_features = np.array(features, dtype=np.float64).reshape(1, -1)
+        return normalize_rows(np_features, 'l2')[0]
+
+
+#feature normalization modes: per query min-max (the LETOR preparation default),
+#collection-level min-max and z-score from precomputed statistics, and log scaling
+NORMALIZATION_MODES = ['query_minmax', 'global_minmax', 'zscore', 'log']
+
+
+class NormalizationStats(object):
+        '''
+            Column statistics of the features of a collection (count, minima, maxima, sums and
+            sums of squares), accumulated block by block in float64 in a single pass; source is
+            the signature (tools.cache.get_file_signature) of the feature file they describe
+        '''
+
+        def __init__(self, count=0, minimum=None, maximum=None, total=None, total_squares=None, source=None):
+            self.count = count
+            self.minimum = minimum
+            self.maximum = maximum
+            self.total = total
+            self.total_squares = total_squares
+            self.source = source
+
+        def get_num_features(self):
+            return 0 if self.minimum is None else len(self.minimum)
+
+        def update(self, features):
+            features = np.asarray(features, dtype=np.float64)
+            if features.shape[0] == 0:
+                return
+            if self.count == 0:
+                self.minimum = features.min(axis=0)
+                self.maximum = features.max(axis=0)
+                self.total = features.sum(axis=0)
+                self.total_squares = np.einsum('ij,ij->j', features, features)
+            else:
+                np.minimum(self.minimum, features.min(axis=0), out=self.minimum)
+                np.maximum(self.maximum, features.max(axis=0), out=self.maximum)
+                self.total += features.sum(axis=0)
+                self.total_squares += np.einsum('ij,ij->j', features, features)
+            self.count += features.shape[0]
+
+        def get_mean(self):
+            return self.total / self.count
+
+        def get_std(self):
+            mean = self.get_mean()
+            return np.sqrt(np.maximum(self.total_squares / self.count - mean * mean, 0.0))
+
+        def save(self, path):
+            '''
+                write the statistics, with the signature of their source and their number of
+                features, as a small .npz artifact
+            '''
+            with open(path, 'wb') as fw:
+                np.savez(fw, count=self.count, minimum=self.minimum, maximum=self.maximum, total=self.total,
+                         total_squares=self.total_squares, source=self.source or '',
+                         num_features=self.get_num_features())
+
+
+def load_normalization_stats(path):
+        with np.load(path) as stats:
+            source = str(stats['source']) if 'source' in stats else None
+            return NormalizationStats(int(stats['count']), stats['minimum'], stats['maximum'], stats['total'],
+                                      stats['total_squares'], source or None)
+
+
+def get_normalization_stats(stats_path, source_path=None):
+        '''
+            the statistics saved at stats_path, None if there are none or if they were computed
+            from another version of the feature file source_path (path, size or mtime changed)
+        '''
+        if stats_path is None or not os.path.exists(stats_path):
+            return None
+        stats = load_normalization_stats(stats_path)
+        if source_path is not None and stats.source != get_file_signature(source_path):
+            return None
+        return stats
+
+
+def compute_normalization_stats(query_blocks, source_path=None):
+        '''
+            statistics of the features of (query_id, docids, features) blocks, in one pass,
+            signed with the signature of the feature file source_path they are read from
+        '''
+        stats = NormalizationStats()
+        if source_path is not None:
+            stats.source = get_file_signature(source_path)
+        for _, _, features in query_blocks:
+            stats.update(features)
+        return stats
+
+
+class FeatureNormalizer(object):
+        '''
+            Column-wise normalization of the (documents, features) block of a query, for the
+            preparation of the datasets and at scoring time alike. 'query_minmax' scales every
+            block by its own bounds, 'global_minmax' and 'zscore' by the collection statistics,
+            'log' maps the values to sign(x) * log(1 + |x|). Constant features are set to 0.
+            Blocks are normalized in their own float dtype (float32 or float64).
+        '''
+
+        def __init__(self, mode='query_minmax', stats=None):
+            if mode not in NORMALIZATION_MODES:
+                raise ValueError('unknown normalization mode: ' + str(mode))
+            if mode in ['global_minmax', 'zscore'] and stats is None:
+                raise ValueError('the ' + mode + ' normalization needs the collection statistics')
+            self.mode = mode
+            self.shift = None
+            self.scale = None
+            if mode == 'global_minmax':
+                self.shift = stats.minimum
+                self.scale = stats.maximum - stats.minimum
+            elif mode == 'zscore':
+                self.shift = stats.get_mean()
+                self.scale = stats.get_std()
+
+        def is_per_query(self):
+            return self.mode == 'query_minmax'
+
+        def normalize(self, features):
+            features = np.asarray(features)
+            if not np.issubdtype(features.dtype, np.floating):
+                features = features.astype(np.float64)
+            if self.mode == 'log':
+                return np.sign(features) * np.log1p(np.abs(features))
+
+            if self.mode == 'query_minmax':
+                if features.shape[0] == 0:
+                    return features.copy()
+                shift = features.min(axis=0)
+                scale = features.max(axis=0) - shift
+            else:
+                if features.shape[-1] != len(self.shift):
+                    raise ValueError('%d features to normalize, the collection statistics have %d'
+                                     % (features.shape[-1], len(self.shift)))
+                shift = self.shift.astype(features.dtype)
+                scale = self.scale.astype(features.dtype)
+            normalized = np.zeros(features.shape, dtype=features.dtype)
+            np.divide(features - shift, scale, out=normalized, where=scale != 0)
+            return normalized
+
+
+def get_feature_normalizer(mode='query_minmax', stats_path=None, query_blocks=None, source_path=None):
+        '''
+            normalizer of a mode; the collection statistics it needs are loaded from stats_path
+            when they are current (computed from the present version of the feature file
+            source_path, when given), otherwise computed from the query_blocks (and saved at
+            stats_path)
+        '''
+        stats = None
+        if mode in ['global_minmax', 'zscore']:
+            stats = get_normalization_stats(stats_path, source_path)
+            if stats is None and query_blocks is not None:
+                stats = compute_normalization_stats(query_blocks, source_path)
+                if stats_path is not None:
+                    stats.save(stats_path)
+        return FeatureNormalizer(mode, stats)
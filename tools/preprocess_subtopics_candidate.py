@@ -77,6 +77,5 @@ def main():
         
         aggregate_suggestion_candidate(folder_path, source_list)
 
-
-
-main()
+if __name__ == '__main__':
+        main()
@@ -0,0 +1,115 @@
+import os
+import sys
+import hashlib
+
+import numpy as np
+
+from loader.qrels import QRELS_UNJUDGED
+
+#number of negative examples per positive example of the distribution types,
+#None for the natural distribution (all the judged negative examples)
+NEGATIVE_RATIOS = {
+    'equal_neg': 1,
+    'double_neg': 2,
+    'triple_neg': 3,
+    'quadruple_neg': 4,
+    'hexaple_neg': 8,
+    'natural': None,
+}
+SAMPLING_STRATEGIES = ['random', 'hard', 'rank_band']
+
+
+def get_negative_ratio(dist_type):
+    '''
+        negative ratio of a distribution type, the unknown types being natural
+    '''
+    return NEGATIVE_RATIOS.get(dist_type)
+
+
+def get_query_rng(seed, query_id):
+    '''
+        NumPy generator of a query, seeded from the global seed and the query id only,
+        so the samples of a query do not depend on the order (or the process) in which
+        the queries are prepared
+    '''
+    key = (str(seed) + ':' + str(query_id)).encode('utf-8')
+    return np.random.default_rng(int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little'))
+
+
+def get_band_quotas(band_counts, number):
+    '''
+        split number samples over bands proportionally to their sizes (largest remainders)
+    '''
+    total = band_counts.sum()
+    if total == 0:
+        return np.zeros_like(band_counts)
+    shares = band_counts * (float(number) / total)
+    quotas = np.floor(shares).astype(np.int64)
+    remainder = number - quotas.sum()
+    if remainder > 0:
+        quotas[np.argsort(quotas - shares, kind='stable')[:remainder]] += 1
+    return np.minimum(quotas, band_counts)
+
+
+def sample_negative_rows(candidate_rows, number, rng, strategy='random', scores=None, num_rows=None, num_bands=4):
+    '''
+        number rows among the candidate negative rows (in baseline rank order):
+        'random' uniformly, 'hard' the highest scored (the best ranked without scores),
+        'rank_band' uniformly within num_bands bands of the baseline ranking, each band
+        contributing in proportion to its candidates
+    '''
+    number = min(number, len(candidate_rows))
+    if number == len(candidate_rows):
+        return candidate_rows
+    if number <= 0:
+        return candidate_rows[:0]
+
+    if strategy == 'hard':
+        if scores is None:
+            return candidate_rows[:number]
+        return candidate_rows[np.sort(np.argsort(-scores[candidate_rows], kind='stable')[:number])]
+
+    keys = rng.random(len(candidate_rows))
+    if strategy == 'random':
+        return np.sort(candidate_rows[np.argpartition(keys, number - 1)[:number]])
+    if strategy == 'rank_band':
+        if num_rows is None:
+            num_rows = int(candidate_rows.max()) + 1
+        bands = candidate_rows * num_bands // max(num_rows, 1)
+        band_counts = np.bincount(bands, minlength=num_bands)
+        quotas = get_band_quotas(band_counts, number)
+        #random order within every band, the quota of each band taken from its start
+        order = np.lexsort((keys, bands))
+        band_starts = np.cumsum(band_counts) - band_counts
+        band_positions = np.arange(len(order)) - band_starts[bands[order]]
+        return np.sort(candidate_rows[order[band_positions < quotas[bands[order]]]])
+    raise ValueError('unknown sampling strategy: ' + str(strategy))
+
+
+def sample_training_rows(grades, dist_type='equal_neg', rng=None, strategy='random', scores=None, num_bands=4):
+    '''
+        rows of the training samples of a query from the relevance grades of its candidate
+        documents (QrelsIndex.lookup, in baseline rank order): all the relevant documents,
+        then ratio times as many judged irrelevant documents (all of them for the natural
+        distribution). Without judged irrelevant documents, as many bottom ranked
+        non-annotated documents as relevant ones are taken instead.
+    '''
+    if rng is None:
+        rng = np.random.default_rng()
+    judged = grades != QRELS_UNJUDGED
+    relevant_rows = np.flatnonzero(grades > 0)
+    irrelevant_rows = np.flatnonzero(judged & (grades <= 0))
+    num_rel = len(relevant_rows)
+
+    if len(irrelevant_rows) == 0:
+        nonannot_rows = np.flatnonzero(~judged)
+        negative_rows = nonannot_rows[len(nonannot_rows) - min(num_rel, len(nonannot_rows)):]
+    else:
+        ratio = get_negative_ratio(dist_type)
+        if ratio is None:
+            negative_rows = irrelevant_rows
+        else:
+            negative_rows = sample_negative_rows(irrelevant_rows, num_rel * ratio, rng, strategy, scores, len(grades),
+                                                 num_bands)
+
+    return np.concatenate([relevant_rows, negative_rows])
@@ -19,6 +19,7 @@ function usage {
 
 
 SCRIPTPATH="/users/sig/mullah/ir/projects/query_performance_predictor/evaluator-extend"
+CODEPATH="$(cd "$(dirname "$0")" && pwd)"
 
 collection=""
 model=""
@@ -99,24 +100,7 @@ then
 	mkdir $DATAPATH/output/l2r-dataset/train
 	mkdir $DATAPATH/output/l2r-dataset/test
 
-	for fold in {1..5}; do
-		while read query; do
-			grep "qid:${query} " $DATAPATH/output/l2r-dataset/${collection}_${model}_${topics}_query.ltr.train.${dist}.${rrank} >> $DATAPATH/output/l2r-dataset/${collection}_${model}_${topics}_query.ltr.train.${dist}.${rrank}.f${fold}
-			grep "qid:${query} " $DATAPATH/output/l2r-dataset/${collection}_${model}_${topics}_query.ltr.test.${dist}.${rrank} >> $DATAPATH/output/l2r-dataset/${collection}_${model}_${topics}_query.ltr.test.${dist}.${rrank}.f${fold}
-		done <$DATAPATH/input/data/f${fold}
-	done
-
-	for foldte in {1..5}; do
-		cat $DATAPATH/output/l2r-dataset/${collection}_${model}_${topics}_query.ltr.test.${dist}.${rrank}.f${foldte} > $DATAPATH/output/l2r-dataset/test/${collection}_${model}_${topics}_query.ltr.test.${dist}.${rrank}.f${foldte}te
-		
-		for foldtr in {1..5}; do
-			if [[ $foldte == $foldtr ]]; 
-			then
-				continue
-			fi
-			cat $DATAPATH/output/l2r-dataset/${collection}_${model}_${topics}_query.ltr.train.${dist}.${rrank}.f${foldtr} >> $DATAPATH/output/l2r-dataset/train/${collection}_${model}_${topics}_query.ltr.train.${dist}.${rrank}.f${foldte}tr
-		done
-	done
+	python3 ${CODEPATH}/l2r.py fold $DATAPATH/output/l2r-dataset/${collection}_${model}_${topics}_query.ltr.train.${dist}.${rrank} $DATAPATH/output/l2r-dataset/${collection}_${model}_${topics}_query.ltr.test.${dist}.${rrank} $DATAPATH/input/data $DATAPATH/output/l2r-dataset/train $DATAPATH/output/l2r-dataset/test
 fi
 
 if ( $pflag )